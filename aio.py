@@ -0,0 +1,60 @@
+import asyncio, threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+import httpx
+
+from config import HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop, starting its thread on first use"""
+    global _loop, _loop_thread
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="aio-loop", daemon=True)
+                thread.start()
+                _loop_thread = thread
+                _loop = loop
+    return _loop
+
+def submit(coro: Coroutine) -> Future:
+    """Schedule a coroutine on the shared loop from any thread"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def run_sync(coro: Coroutine, timeout: float = None) -> Any:
+    """
+    Run a coroutine on the shared loop and block until it finishes.
+    Used by the synchronous wrappers; must not be called from the loop itself.
+    """
+    if _loop_thread is not None and threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync() called from the event loop, await the coroutine instead")
+    return submit(coro).result(timeout)
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared async HTTP client. Connections are pooled and kept
+    alive between requests to the same host.
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            timeout=10,
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=30,
+            ),
+        )
+    return _http_client
@@ -0,0 +1,210 @@
+import difflib, math, threading, time
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+from utils import normalize_text, STOPWORDS
+
+MAX_CANDIDATES = 50
+# Features shared by more entries than this ("the", " wh") say little about a
+# match and are skipped when gathering candidates
+COMMON_FEATURE_LIMIT = 200
+WORD_WEIGHT = 2.0
+# Longer words may match a required word with a typo in it
+FUZZY_MIN_LENGTH = 5
+FUZZY_RATIO = 0.8
+# Questions with these words refer to something said earlier ("how old is
+# he now?", "what is the weather there?"), their answers depend on the chat
+CONTEXT_WORDS = {"he", "him", "his", "she", "her", "hers", "they", "them", "their", "theirs", "it", "its",
+                 "this", "that", "these", "those", "there", "here", "then", "i", "me", "my", "mine",
+                 "we", "us", "our", "ours"}
+
+def question_features(normalized: str) -> Dict[str, float]:
+    """
+    Sparse vector of word unigrams and character trigrams. Trigrams make the
+    similarity tolerant to typos and word forms, words keep it precise.
+    """
+    features = Counter()
+    for word in normalized.split():
+        features["w:" + word] += WORD_WEIGHT
+    padded = f" {normalized} "
+    for i in range(len(padded) - 2):
+        features["c:" + padded[i:i + 3]] += 1.0
+    return dict(features)
+
+def _norm(vector: Dict[str, float]) -> float:
+    return math.sqrt(sum(v * v for v in vector.values()))
+
+def _is_exact_word(word: str) -> bool:
+    """Numbers and words with symbols in them (2022, c++, c#) only match themselves"""
+    return not word.replace("'", "").replace("-", "").isalpha()
+
+def _has_word(word: str, words: Set[str]) -> bool:
+    if word in words:
+        return True
+    if _is_exact_word(word) or len(word) < FUZZY_MIN_LENGTH:
+        return False
+    return any(abs(len(word) - len(other)) <= 1 and
+               difflib.SequenceMatcher(None, word, other).ratio() >= FUZZY_RATIO for other in words)
+
+def is_standalone(question: str) -> bool:
+    """Whether a question can be understood, and answered, without the chat before it"""
+    # "he's" and "it's" count as "he" and "it"
+    return not any(word.split("'")[0] in CONTEXT_WORDS for word in normalize_text(question).split())
+
+def required_words(normalized: str, document_frequency) -> List[str]:
+    """
+    Words a cached question must also contain to be a match: numbers, words
+    with symbols and every other word that is neither a stop word nor one of
+    the cache's most common words. "2018" vs "2022" or "java" vs "c++" differ
+    in a single word, which the similarity alone does not punish enough.
+    """
+    required = []
+    for word in normalized.split():
+        if _is_exact_word(word) or (word not in STOPWORDS and
+                                    document_frequency("w:" + word) <= COMMON_FEATURE_LIMIT):
+            required.append(word)
+    return required
+
+class AnswerCache:
+    """
+    In-process cache of final answers keyed by question similarity.
+
+    Questions are compared by cosine similarity of n-gram vectors weighted by
+    inverse document frequency across the cached questions, so the words that
+    tell questions apart count more than the ones they share. A match must
+    also contain the query's numbers and rare words (see required_words). An
+    inverted index over the features keeps lookups from scanning every entry. Entries
+    expire after `ttl` seconds and the least recently used are evicted past
+    `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 6 * 3600, threshold: float = 0.78):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._by_question: Dict[str, int] = {}
+        self._index: Dict[str, set] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._by_question.pop(entry["question"], None)
+        for feature in entry["vector"]:
+            postings = self._index.get(feature)
+            if postings is not None:
+                postings.discard(entry_id)
+                if not postings:
+                    del self._index[feature]
+
+    def _document_frequency(self, feature: str) -> int:
+        return len(self._index.get(feature, ()))
+
+    def _weighted_norm(self, vector: Dict[str, float], idf: Dict[str, float]) -> float:
+        return math.sqrt(sum((weight * idf[feature]) ** 2 for feature, weight in vector.items()))
+
+    def _idf(self, features: Iterable[str], idf: Dict[str, float]) -> None:
+        """Fill in the smoothed IDF of features not in `idf` yet"""
+        count = len(self._entries)
+        for feature in features:
+            if feature not in idf:
+                idf[feature] = math.log((count + 1) / (self._document_frequency(feature) + 1)) + 1
+
+    def lookup(self, question: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Find a fresh cached answer for a similar question
+
+        :return: (entry, similarity) with the entry's 'answer' and 'sources', or None
+        """
+        normalized = normalize_text(question)
+        vector = question_features(normalized)
+        if not _norm(vector):
+            return None
+
+        now = time.time()
+        with self._lock:
+            idf: Dict[str, float] = {}
+            self._idf(vector, idf)
+            norm = self._weighted_norm(vector, idf)
+            required = required_words(normalized, self._document_frequency)
+            query_words = set(normalized.split())
+
+            overlap = Counter()
+            for feature in vector:
+                postings = self._index.get(feature, ())
+                if len(postings) > COMMON_FEATURE_LIMIT:
+                    continue
+                for entry_id in postings:
+                    overlap[entry_id] += 1
+
+            best, best_score = None, 0.0
+            for entry_id, _ in overlap.most_common(MAX_CANDIDATES):
+                entry = self._entries[entry_id]
+                if now - entry["created_at"] > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                if not all(_has_word(word, entry["words"]) for word in required):
+                    continue
+                # Numbers and symbols count both ways: "world cup" is not "2022 world cup"
+                if not entry["exact_words"] <= query_words:
+                    continue
+                self._idf(entry["vector"], idf)
+                dot = sum(weight * entry["vector"].get(feature, 0.0) * idf[feature] ** 2
+                          for feature, weight in vector.items())
+                score = dot / (norm * self._weighted_norm(entry["vector"], idf))
+                if score > best_score:
+                    best, best_score = entry_id, score
+
+            metrics.observe("answer_cache.best_score", best_score)
+            if best is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best)
+                self.hits += 1
+                return dict(self._entries[best]), best_score
+            self.misses += 1
+            return None
+
+    def add(self, question: str, answer: str, sources: List[str] = None) -> None:
+        """Cache the final answer to a question"""
+        normalized = normalize_text(question)
+        vector = question_features(normalized)
+        if not _norm(vector) or not answer:
+            return
+
+        with self._lock:
+            existing = self._by_question.get(normalized)
+            if existing is not None:
+                self._remove(existing)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "question": normalized,
+                "answer": answer,
+                "sources": list(sources or []),
+                "vector": vector,
+                "words": set(normalized.split()),
+                "exact_words": {word for word in normalized.split() if _is_exact_word(word)},
+                "created_at": time.time(),
+            }
+            self._by_question[normalized] = entry_id
+            for feature in vector:
+                self._index.setdefault(feature, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
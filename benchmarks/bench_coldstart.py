@@ -0,0 +1,145 @@
+"""
+Cold-start benchmark: how long a fresh bot process takes to import, to
+answer GET /health, and to send its first reply to a webhook, against the
+local stand-ins from benchmarks/stub_services.py.
+
+Every run starts a new interpreter, with and without background prewarming.
+
+Usage:
+    python benchmarks/bench_coldstart.py [--runs 5] [--prewarm both|on|off]
+"""
+import argparse, json, os, socket, statistics, subprocess, sys, tempfile, threading, time
+import urllib.error, urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_services import FINAL_MARKER, StubConfig, start_stub_server, stub_environment
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def bot_environment(stubs_url: str, workdir: str, prewarm: bool, port: int = 0):
+    env = dict(os.environ)
+    env.update(stub_environment(stubs_url))
+    env.update({
+        "PYTHONPATH": ROOT,
+        "PORT": str(port),
+        "PREWARM": "1" if prewarm else "0",
+        # Settings come from the environment, like in a container
+        "LOAD_DOTENV": "0",
+        "MEMORY_DB": os.path.join(workdir, "chat_memory.db"),
+        "TYPING_INDICATOR": "0",
+        "TRACE_TURNS": "0",
+    })
+    return env
+
+def measure_import(env, workdir: str) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, cwd=workdir,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+def slowest_imports(env, workdir: str, top: int = 8):
+    """Modules with the largest cumulative import time, from python -X importtime"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=env, cwd=workdir,
+                         capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Only top-level imports, nested ones are included in their parent
+        if name.startswith(" ") and not name.startswith("  "):
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+def wait_for_health(url: str, deadline: float) -> bool:
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health", timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.01)
+    return False
+
+def post_webhook(url: str, sender_id: str, text: str) -> None:
+    body = {"object": "page", "entry": [{"id": "stub-page", "messaging": [{
+        "sender": {"id": sender_id}, "recipient": {"id": "stub-page"},
+        "message": {"mid": f"mid.{time.time_ns()}", "text": text}}]}]}
+    request = urllib.request.Request(f"{url}/webhook", data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    urllib.request.urlopen(request, timeout=10).read()
+
+def measure_start(env, workdir: str, port: int, replied: threading.Event, timeout: float):
+    """Start the bot, return (seconds to /health, seconds to first reply from start, from webhook)"""
+    replied.clear()
+    url = f"http://127.0.0.1:{port}"
+    started_at = time.monotonic()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "main.py")], env=env, cwd=workdir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_health(url, started_at + timeout):
+            raise RuntimeError("bot did not answer /health in time")
+        healthy_at = time.monotonic()
+        post_webhook(url, "coldstart-user", "What is the latest python release?")
+        sent_at = time.monotonic()
+        if not replied.wait(timeout):
+            raise RuntimeError("bot did not reply in time")
+        replied_at = time.monotonic()
+        return healthy_at - started_at, replied_at - started_at, replied_at - sent_at
+    finally:
+        process.terminate()
+        process.wait(10)
+
+def report(name, values, unit="s"):
+    print(f"  {name:34} median {statistics.median(values):7.3f}{unit}   min {min(values):7.3f}{unit}   "
+          f"max {max(values):7.3f}{unit}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bot cold-start times")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--prewarm", choices=["both", "on", "off"], default="both")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    replied = threading.Event()
+
+    def on_send(payload):
+        if FINAL_MARKER in payload.get("message", {}).get("text", ""):
+            replied.set()
+
+    # Fast stand-ins, the benchmark is about the bot's own start-up cost
+    stubs = start_stub_server(StubConfig(llm_latency=0.01, search_latency=0.01, page_latency=0.01,
+                                         send_latency=0), on_send=on_send)
+    modes = {"both": [True, False], "on": [True], "off": [False]}[args.prewarm]
+
+    for prewarm in modes:
+        workdir = tempfile.mkdtemp(prefix="bot-coldstart-")
+        env = bot_environment(stubs.base_url, workdir, prewarm)
+        imports, health, first_reply, reply_after_webhook = [], [], [], []
+        for _ in range(args.runs):
+            imports.append(measure_import(env, workdir))
+            port = free_port()
+            env["PORT"] = str(port)
+            h, r, w = measure_start(env, workdir, port, replied, args.timeout)
+            health.append(h)
+            first_reply.append(r)
+            reply_after_webhook.append(w)
+
+        print(f"\nPrewarm {'on' if prewarm else 'off'} ({args.runs} runs)")
+        report("import main", imports)
+        report("process start to /health", health)
+        report("process start to first reply", first_reply)
+        report("webhook to first reply", reply_after_webhook)
+
+    print("\nSlowest top-level imports of main (cumulative):")
+    for microseconds, name in slowest_imports(env, workdir):
+        print(f"  {microseconds / 1000:8.1f} ms  {name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Compare the streaming HTML extractor with the original BeautifulSoup one on
+the saved pages in benchmarks/fixtures.
+
+Usage:
+    python benchmarks/bench_extract.py [--iterations 50] [--max-length 2000]
+"""
+import argparse, difflib, glob, os, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from extract import extract_content_bs4, extract_content_stream, parse_search_results
+from web import extract_search_results
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def time_call(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func()
+    return (time.perf_counter() - start) / iterations * 1000, result
+
+def report(name, legacy_ms, fast_ms, legacy_out, fast_out):
+    similarity = difflib.SequenceMatcher(None, str(legacy_out), str(fast_out)).ratio()
+    print(f"{name:28} bs4 {legacy_ms:8.2f} ms   stream {fast_ms:8.2f} ms   "
+          f"speedup {legacy_ms / fast_ms:5.1f}x   similarity {similarity:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML extraction engines")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--max-length", type=int, default=2000)
+    args = parser.parse_args()
+
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "*.html"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            html = f.read()
+        name = os.path.basename(path)
+
+        if name.startswith("ddg_"):
+            legacy_ms, legacy_out = time_call(
+                lambda: extract_search_results(BeautifulSoup(html, "html.parser")), args.iterations)
+            fast_ms, fast_out = time_call(lambda: parse_search_results(html), args.iterations)
+        else:
+            legacy_ms, legacy_out = time_call(
+                lambda: extract_content_bs4(html, args.max_length), args.iterations)
+            fast_ms, fast_out = time_call(
+                lambda: extract_content_stream(html, args.max_length), args.iterations)
+
+        report(name, legacy_ms, fast_ms, legacy_out, fast_out)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark for utils.parse_response on long, tag-heavy LLM outputs,
+compared with the original find/slice implementation.
+
+Usage:
+    python benchmarks/bench_parse.py [--iterations 20]
+"""
+import argparse, os, random, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import parse_response, StreamParser
+
+def legacy_parse_response(response_text):
+    """The original implementation, kept here for comparison"""
+    result = {"tools": [], "say_message": None, "task_finished": None, "continue_task": True}
+
+    if "<say_in_middle>" in response_text and "</say_in_middle>" in response_text:
+        start = response_text.find("<say_in_middle>") + len("<say_in_middle>")
+        end = response_text.find("</say_in_middle>")
+        if start < end:
+            result["say_message"] = response_text[start:end].strip()
+            response_text = response_text[:start-len("<say_in_middle>")] + response_text[end+len("</say_in_middle>"):]
+
+    while "<web_search>" in response_text and "</web_search>" in response_text:
+        start = response_text.find("<web_search>") + len("<web_search>")
+        end = response_text.find("</web_search>")
+        if start < end:
+            query = response_text[start:end].strip()
+            result["tools"].append({"tool": "web_search", "query": query})
+            response_text = response_text[:start-len("<web_search>")] + response_text[end+len("</web_search>"):]
+
+    while "<browse_url>" in response_text and "</browse_url>" in response_text:
+        start = response_text.find("<browse_url>") + len("<browse_url>")
+        end = response_text.find("</browse_url>")
+        if start < end:
+            url = response_text[start:end].strip()
+            result["tools"].append({"tool": "browse_url", "url": url})
+            response_text = response_text[:start-len("<browse_url>")] + response_text[end+len("</browse_url>"):]
+
+    remaining_text = response_text.strip()
+    if not result["tools"] and not result["say_message"] and remaining_text:
+        result["task_finished"] = remaining_text
+        result["continue_task"] = False
+    elif result["tools"] and remaining_text:
+        result["task_finished"] = remaining_text
+        result["continue_task"] = True
+    return result
+
+def make_output(tags, seed=1):
+    rng = random.Random(seed)
+    parts = ["<say_in_middle>Let me look that up for you...</say_in_middle>\n"]
+    for i in range(tags):
+        parts.append("Some reasoning about the previous result, " * rng.randint(1, 4))
+        if rng.random() < 0.5:
+            parts.append(f"<web_search>query number {i} about something</web_search>\n")
+        else:
+            parts.append(f"<browse_url>https://example.com/page/{i}</browse_url>\n")
+    parts.append("That is everything I found.")
+    return "".join(parts)
+
+def bench(func, text, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(text)
+    return (time.perf_counter() - start) / iterations * 1000
+
+def stream_all(text, chunk_size=8):
+    parser = StreamParser()
+    for i in range(0, len(text), chunk_size):
+        parser.feed(text[i:i + chunk_size])
+    return parser
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse_response")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    for tags in (10, 100, 1000, 5000):
+        text = make_output(tags)
+        legacy_ms = bench(legacy_parse_response, text, args.iterations)
+        new_ms = bench(parse_response, text, args.iterations)
+        stream_ms = bench(stream_all, text, max(1, args.iterations // 4))
+        same = sorted(map(str, legacy_parse_response(text)["tools"])) == sorted(map(str, parse_response(text)["tools"]))
+        print(f"{tags:5} tags  {len(text):8} chars   legacy {legacy_ms:9.2f} ms   "
+              f"single-pass {new_ms:7.2f} ms   streamed {stream_ms:8.2f} ms   same tools: {same}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Offline load test: runs the bot against local stand-ins for Groq, DuckDuckGo
+and the Graph API (benchmarks/stub_services.py) and replays webhook traffic
+for many senders.
+
+Every simulated sender sends a question, waits for the final reply, then
+sends the next one. The report shows turns/sec, end-to-end latency
+percentiles, per-stage latencies from /metrics, process memory growth and
+the size of the chat memory store.
+
+Usage:
+    python benchmarks/loadtest.py [--senders 50] [--turns 5] [--llm-latency 0.3]
+
+The bot runs in this process with its working files in a temporary
+directory; rate limits are lifted unless --keep-rate-limits is given.
+"""
+import argparse, glob, os, queue, sys, tempfile, threading, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+
+from stub_services import FINAL_MARKER, StubConfig, start_stub_server, stub_environment
+
+# Replies that end a turn without an answer
+FAILURE_REPLIES = ("I'm sorry, I encountered an error", "I'm having trouble responding",
+                   "let me wrap this up")
+BUSY_REPLY = "I'm getting a lot of messages right now"
+
+TOPICS = ["python asyncio", "sqlite wal mode", "http keep-alive", "messenger bots", "llm latency",
+          "duckduckgo html", "token buckets", "lru caches", "gzip archives", "process pools"]
+
+def rss_bytes() -> int:
+    """Resident set size of this process, 0 if it cannot be read"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            # Peak rather than current on platforms without /proc
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return 0
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+def store_size(workdir: str) -> int:
+    """Bytes used by the chat memory store (JSON file or SQLite database with its WAL)"""
+    paths = glob.glob(os.path.join(workdir, "chat_memory.json")) + glob.glob(os.path.join(workdir, "*.db*"))
+    return sum(os.path.getsize(path) for path in paths)
+
+class Replies:
+    """Collects the messages the Graph stand-in receives, per recipient"""
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.actions = 0
+
+    def queue_for(self, recipient_id: str) -> "queue.Queue":
+        with self._lock:
+            return self._queues.setdefault(recipient_id, queue.Queue())
+
+    def on_send(self, payload):
+        recipient_id = payload.get("recipient", {}).get("id")
+        text = payload.get("message", {}).get("text")
+        if text is None:
+            self.actions += 1
+            return
+        self.messages += 1
+        if FINAL_MARKER in text:
+            self.queue_for(recipient_id).put(("ok", time.monotonic()))
+        elif text.startswith(BUSY_REPLY):
+            self.queue_for(recipient_id).put(("busy", time.monotonic()))
+        elif any(failure in text for failure in FAILURE_REPLIES):
+            self.queue_for(recipient_id).put(("failed", time.monotonic()))
+
+def webhook_payload(sender_id: str, mid: str, text: str):
+    now = int(time.time() * 1000)
+    return {
+        "object": "page",
+        "entry": [{
+            "id": "stub-page",
+            "time": now,
+            "messaging": [{
+                "sender": {"id": sender_id},
+                "recipient": {"id": "stub-page"},
+                "timestamp": now,
+                "message": {"mid": mid, "text": text},
+            }],
+        }],
+    }
+
+def run_sender(client: httpx.Client, app_url: str, index: int, turns: int, think_time: float,
+               timeout: float, replies: Replies, results: list) -> None:
+    sender_id = f"sender-{index}"
+    inbox = replies.queue_for(sender_id)
+    for turn in range(turns):
+        topic = TOPICS[(index + turn) % len(TOPICS)]
+        text = f"What is new with {topic} for {sender_id} in question {turn}?"
+        started_at = time.monotonic()
+        try:
+            client.post(f"{app_url}/webhook", json=webhook_payload(sender_id, f"mid.{sender_id}.{turn}", text))
+            outcome, finished_at = inbox.get(timeout=timeout)
+        except queue.Empty:
+            outcome, finished_at = "timeout", time.monotonic()
+        except httpx.HTTPError:
+            outcome, finished_at = "webhook_error", time.monotonic()
+        results.append((outcome, finished_at - started_at))
+        if think_time:
+            time.sleep(think_time)
+
+def start_app(port: int) -> str:
+    """Import the bot (after the environment is set up) and serve it in a thread"""
+    from werkzeug.serving import make_server
+    import main as bot
+
+    server = make_server("127.0.0.1", port, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bot-server", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against stubbed upstream services")
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=5, help="questions per sender")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds a sender waits between turns")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for a reply")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--llm-chunks", type=int, default=8)
+    parser.add_argument("--search-latency", type=float, default=0.2)
+    parser.add_argument("--page-latency", type=float, default=0.2)
+    parser.add_argument("--send-latency", type=float, default=0.05)
+    parser.add_argument("--tool-ratio", type=float, default=0.8, help="share of questions that search")
+    parser.add_argument("--browse-ratio", type=float, default=0.5, help="share of searches followed by a page fetch")
+    parser.add_argument("--keep-rate-limits", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report Python heap growth (slower)")
+    args = parser.parse_args()
+
+    replies = Replies()
+    config = StubConfig(llm_latency=args.llm_latency, llm_chunks=args.llm_chunks,
+                        search_latency=args.search_latency, page_latency=args.page_latency,
+                        send_latency=args.send_latency, tool_ratio=args.tool_ratio,
+                        browse_ratio=args.browse_ratio)
+    stubs = start_stub_server(config, on_send=replies.on_send)
+
+    workdir = tempfile.mkdtemp(prefix="bot-loadtest-")
+    os.chdir(workdir)
+    os.environ.update(stub_environment(stubs.base_url))
+    # Never touch the real chat memory
+    os.environ["MEMORY_DB"] = os.path.join(workdir, "chat_memory.db")
+    os.environ["SEARCH_CACHE_FILE"] = ""
+    os.environ["SUMMARY_CACHE_FILE"] = ""
+    os.environ.setdefault("TRACE_TURNS", "0")
+    if not args.keep_rate_limits:
+        for name in ("SENDER_RATE_PER_MINUTE", "SENDER_BURST", "GLOBAL_RATE_PER_SECOND", "GLOBAL_BURST"):
+            os.environ.setdefault(name, "1000000")
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+    app_url = start_app(0)
+    rss_started = rss_bytes()
+    print(f"Stubs on {stubs.base_url}, bot on {app_url}, working files in {workdir}")
+
+    results = []
+    limits = httpx.Limits(max_connections=args.senders, max_keepalive_connections=args.senders)
+    with httpx.Client(timeout=30, limits=limits) as client:
+        threads = [threading.Thread(target=run_sender, args=(client, app_url, i, args.turns,
+                                                             args.think_time, args.timeout, replies, results))
+                   for i in range(args.senders)]
+        started_at = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started_at
+        app_metrics = client.get(f"{app_url}/metrics").json()
+
+    import memory
+    memory.flush_chat_memory()
+    rss_after = rss_bytes()
+
+    latencies = [seconds for outcome, seconds in results if outcome == "ok"]
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    print(f"\n{len(results)} turns from {args.senders} senders in {elapsed:.1f}s: "
+          f"{len(latencies) / elapsed:.2f} answered turns/sec")
+    print("Outcomes: " + ", ".join(f"{name} {count}" for name, count in sorted(outcomes.items())))
+    print(f"End-to-end latency: p50 {percentile(latencies, 50):.2f}s  p95 {percentile(latencies, 95):.2f}s  "
+          f"p99 {percentile(latencies, 99):.2f}s  max {max(latencies, default=0):.2f}s")
+    print(f"Messages sent {replies.messages}, sender actions {replies.actions}")
+
+    histograms = app_metrics.get("histograms", {})
+    stages = sorted(name for name in histograms if name.startswith(("stage.", "turn.", "llm.")))
+    if stages:
+        print("\nStage                                     count      p50      p95      p99")
+        for name in stages:
+            h = histograms[name]
+            print(f"{name:40} {h['count']:6} {h['p50']:8.3f} {h['p95']:8.3f} {h['p99']:8.3f}")
+
+    mib = 1024 * 1024
+    print(f"\nRSS: {rss_before / mib:.1f} MiB before start, {rss_started / mib:.1f} MiB after start, "
+          f"{rss_after / mib:.1f} MiB after the run (+{(rss_after - rss_started) / mib:.1f} MiB)")
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        print(f"Python heap: {current / mib:.1f} MiB now, {peak / mib:.1f} MiB peak")
+    print(f"Chat memory store: {store_size(workdir) / 1024:.1f} KiB")
+
+if __name__ == '__main__':
+    main()
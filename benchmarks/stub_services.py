@@ -0,0 +1,227 @@
+"""
+Local stand-ins for the Groq chat completions API, DuckDuckGo's HTML search,
+the pages it links to and the Graph Send API, for offline load tests.
+
+All of them are served by one threaded HTTP server:
+
+    POST /openai/v1/chat/completions   Groq (set GROQ_BASE_URL to the server root)
+    GET  /html/?q=...                   DuckDuckGo (SEARCH_URL)
+    GET  /page/<n>                      pages linked from the search results
+    POST /v18.0/me/messages             Graph Send API (GRAPH_API_URL)
+
+The LLM stand-in follows a script: a new question gets a progress message
+and a <web_search> tag, search results are followed by a <browse_url> tag
+for a share of the questions, and tool output is answered with a final reply
+ending in FINAL_MARKER.
+
+Usage (standalone, for pointing a separately started bot at it):
+    python benchmarks/stub_services.py [--port 8001] [--llm-latency 0.3]
+"""
+import argparse, hashlib, json, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+from urllib.parse import parse_qs, urlsplit
+
+FINAL_MARKER = "(end of answer)"
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+class StubConfig:
+    """Latencies in seconds and the shape of the scripted conversations"""
+
+    def __init__(self, llm_latency: float = 0.3, llm_chunks: int = 8, search_latency: float = 0.2,
+                 page_latency: float = 0.2, send_latency: float = 0.05, tool_ratio: float = 0.8,
+                 browse_ratio: float = 0.5, page_max_age: int = 0):
+        self.llm_latency = llm_latency
+        self.llm_chunks = llm_chunks
+        self.search_latency = search_latency
+        self.page_latency = page_latency
+        self.send_latency = send_latency
+        self.tool_ratio = tool_ratio
+        self.browse_ratio = browse_ratio
+        self.page_max_age = page_max_age
+
+def _fraction(text: str) -> float:
+    """Deterministic number in [0, 1) derived from text"""
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16) / 0x100000000
+
+def scripted_reply(messages, config: StubConfig) -> str:
+    """Decide what the LLM stand-in says for a conversation"""
+    if messages and messages[0].get("content", "").startswith("Summarize the conversation"):
+        return "The user asked several questions and the assistant looked them up."
+
+    last = messages[-1] if messages else {"role": "user", "content": ""}
+    question = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    content = last.get("content", "")
+    if last.get("role") == "user" and _fraction(question) < config.tool_ratio:
+        return (f"<say_in_middle>Let me look that up for you.</say_in_middle>\n"
+                f"<web_search>{question[:80]}</web_search>")
+    if content.startswith("Search results for") and _fraction("browse:" + question) < config.browse_ratio:
+        page = int(_fraction("page:" + question) * 1000)
+        return f"<browse_url>{content_url(page)}</browse_url>"
+    words = " ".join(question.split()[:12])
+    return (f"Here is what I found about {words}. The sources agree on the main points, "
+            f"and the details are summarized above. {FINAL_MARKER}")
+
+_base_url = "http://127.0.0.1"
+
+def content_url(page: int) -> str:
+    return f"{_base_url}/page/{page}"
+
+def _load_fixture(name: str, fallback: str) -> str:
+    try:
+        with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return fallback
+
+def search_page(query: str) -> str:
+    results = []
+    for i in range(8):
+        page = int(_fraction(f"{query}:{i}") * 1000)
+        results.append(f"""
+  <div class="result results_links results_links_deep web-result ">
+    <div class="links_main links_deep result__body">
+      <h2 class="result__title"><a rel="nofollow" class="result__a" href="{content_url(page)}">Result {i} for {query}</a></h2>
+      <a class="result__snippet" href="{content_url(page)}">Snippet {i}: background, numbers and context about {query}.</a>
+    </div>
+  </div>""")
+    return f"""<!DOCTYPE html>
+<html><head><title>{query} at DuckDuckGo</title></head>
+<body class="body--html"><div id="links" class="results">{"".join(results)}
+</div></body></html>"""
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = StubConfig()
+    article: str = ""
+    on_send: Optional[Callable[[Dict], None]] = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _reply(self, status: int, body: bytes, content_type: str, headers: Dict[str, str] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path.startswith("/html"):
+            time.sleep(self.config.search_latency)
+            query = parse_qs(parts.query).get("q", [""])[0]
+            self._reply(200, search_page(query).encode("utf-8"), "text/html; charset=utf-8")
+        elif parts.path.startswith("/page/"):
+            time.sleep(self.config.page_latency)
+            self._reply(200, self.article.encode("utf-8"), "text/html; charset=utf-8",
+                        {"Cache-Control": f"max-age={self.config.page_max_age}"})
+        else:
+            self._reply(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path.endswith("/chat/completions"):
+            self._chat_completion(self._read_json())
+        elif path.endswith("/me/messages"):
+            payload = self._read_json()
+            time.sleep(self.config.send_latency)
+            if self.on_send is not None:
+                self.on_send(payload)
+            body = {"recipient_id": payload.get("recipient", {}).get("id"), "message_id": f"m.{time.time_ns()}"}
+            self._reply(200, json.dumps(body).encode("utf-8"), "application/json")
+        else:
+            self._reply(404, b"not found", "text/plain")
+
+    def _chat_completion(self, request: Dict) -> None:
+        text = scripted_reply(request.get("messages", []), self.config)
+        prompt_tokens = sum(len(m.get("content", "")) for m in request.get("messages", [])) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                 "total_tokens": prompt_tokens + len(text) // 4}
+        base = {"id": f"chatcmpl-{time.time_ns()}", "created": int(time.time()), "model": request.get("model")}
+
+        if not request.get("stream"):
+            time.sleep(self.config.llm_latency)
+            body = dict(base, object="chat.completion", usage=usage, choices=[
+                {"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}])
+            self._reply(200, json.dumps(body).encode("utf-8"), "application/json")
+            return
+
+        # Server-sent events, the latency is spread over the chunks
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunks = max(1, self.config.llm_chunks)
+        size = max(1, -(-len(text) // chunks))
+        try:
+            for i in range(0, len(text), size):
+                time.sleep(self.config.llm_latency / chunks)
+                chunk = dict(base, object="chat.completion.chunk", choices=[
+                    {"index": 0, "delta": {"role": "assistant", "content": text[i:i + size]}, "finish_reason": None}])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            last = dict(base, object="chat.completion.chunk", x_groq={"id": base["id"], "usage": usage},
+                        choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            self.wfile.write(f"data: {json.dumps(last)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The bot stops reading once a tool tag is complete
+            pass
+        self.close_connection = True
+
+def start_stub_server(config: StubConfig, port: int = 0,
+                      on_send: Callable[[Dict], None] = None) -> ThreadingHTTPServer:
+    """Start the stand-ins in a background thread; the base URL is server.base_url"""
+    global _base_url
+    handler = type("ConfiguredStubHandler", (StubHandler,), {
+        "config": config,
+        "article": _load_fixture("article_nested.html", "<html><body><article><p>Stub page.</p></article></body></html>"),
+        "on_send": staticmethod(on_send) if on_send else None,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    _base_url = server.base_url
+    threading.Thread(target=server.serve_forever, name="stub-services", daemon=True).start()
+    return server
+
+def stub_environment(base_url: str) -> Dict[str, str]:
+    """Environment variables that point the bot at the stand-ins"""
+    return {
+        "GROQ_BASE_URL": base_url,
+        "GROQ_API_KEY": "stub",
+        "SEARCH_URL": f"{base_url}/html/",
+        "GRAPH_API_URL": f"{base_url}/v18.0/me/messages",
+        "PAGE_ACCESS_TOKEN": "stub",
+        "VERIFY_TOKEN": "stub",
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve stand-ins for Groq, DuckDuckGo and the Graph API")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--search-latency", type=float, default=0.2)
+    parser.add_argument("--page-latency", type=float, default=0.2)
+    parser.add_argument("--send-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    config = StubConfig(llm_latency=args.llm_latency, search_latency=args.search_latency,
+                        page_latency=args.page_latency, send_latency=args.send_latency)
+    server = start_stub_server(config, args.port)
+    print(f"Stub services on {server.base_url}; start the bot with:")
+    for name, value in stub_environment(server.base_url).items():
+        print(f"  {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -1,63 +1,253 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse, urljoin
-import re
-
-def clean_text(text):
-    # Remove extra whitespace and normalize
-    text = re.sub(r'\s+', ' ', text).strip()
-    # Remove scripts and style content
-    text = re.sub(r'<script.*?</script>', '', text, flags=re.DOTALL)
-    text = re.sub(r'<style.*?</style>', '', text, flags=re.DOTALL)
-    return text
+import asyncio
+import codecs
+import time
+import httpx
+from collections import OrderedDict
 
-def browse_website(url, max_length=2000):
+from aio import get_http_client, run_sync
+from deadline import timeout_for
+from extract import extract_content_bs4, extract_content_stream, StreamingExtractor
+from page_cache import PageCache, canonicalize_url
+import metrics
+from config import (PAGE_CACHE_MAX_BYTES, PAGE_CACHE_DEFAULT_TTL, HTML_EXTRACTOR, BROWSE_MAX_BYTES,
+                    PREFETCH_CONCURRENCY, PREFETCH_BUDGET_BYTES, PREFETCH_MAX_PAGE_BYTES, PREFETCH_TTL)
+
+HTML_CONTENT_TYPES = {"text/html", "application/xhtml+xml"}
+READ_CHUNK_SIZE = 16384
+
+page_cache = PageCache(PAGE_CACHE_MAX_BYTES, PAGE_CACHE_DEFAULT_TTL)
+metrics.register_gauge("page_cache", page_cache.stats)
+
+def extract_content(html, max_length=2000):
+    """Extract the title and main text of an HTML page with the configured engine"""
+    if HTML_EXTRACTOR == "bs4":
+        return extract_content_bs4(html, max_length)
+    return extract_content_stream(html, max_length)
+
+def check_response_headers(headers):
+    """Return an error message if the response is not an HTML page of acceptable size"""
+    content_type = headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type and content_type not in HTML_CONTENT_TYPES:
+        return f"Unsupported content type: {content_type}"
+    content_length = headers.get("Content-Length")
+    if content_length and content_length.isdigit() and int(content_length) > BROWSE_MAX_BYTES:
+        return f"Page is too large to read ({int(content_length)} bytes)"
+    return None
+
+async def read_content(response, max_length=2000, max_bytes=BROWSE_MAX_BYTES):
+    """
+    Read an HTML response in chunks, at most max_bytes, and extract
+    its text. With the streaming engine chunks are parsed as they arrive and
+    the download stops as soon as enough text has been extracted.
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    if HTML_EXTRACTOR == "bs4":
+        parts = []
+        received = 0
+        async for chunk in response.aiter_bytes(READ_CHUNK_SIZE):
+            received += len(chunk)
+            parts.append(decoder.decode(chunk))
+            if received >= max_bytes:
+                break
+        parts.append(decoder.decode(b"", final=True))
+        # Parsing is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(extract_content_bs4, "".join(parts), max_length)
+
+    extractor = StreamingExtractor(max_length)
+    received = 0
+    async for chunk in response.aiter_bytes(READ_CHUNK_SIZE):
+        received += len(chunk)
+        extractor.feed(decoder.decode(chunk))
+        if extractor.done or received >= max_bytes:
+            break
+    extractor.feed(decoder.decode(b"", final=True))
+    extractor.close()
+    return extractor.result()
+
+def page_key(url, max_length=2000):
+    """Return the URL with a scheme and the page cache key for it"""
+    # Add scheme if not present
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url, f"{max_length}:{canonicalize_url(url)}"
+
+class Prefetcher:
+    """
+    Fetches pages in the background ahead of a browse_url call, typically
+    the top search results. At most `concurrency` fetches run at once, and
+    in-flight downloads plus prefetched pages that have not been browsed yet
+    may not exceed `budget_bytes`. Pages not browsed within `ttl` seconds are
+    dropped and counted as wasted.
+
+    All methods except stats() must be called on the event loop.
+    """
+
+    def __init__(self, concurrency=4, budget_bytes=4 * 1024 * 1024, max_page_bytes=512 * 1024, ttl=120):
+        self.concurrency = concurrency
+        self.budget_bytes = budget_bytes
+        self.max_page_bytes = max_page_bytes
+        self.ttl = ttl
+        self._semaphore = None
+        self._inflight = {}
+        # key -> (content, bytes downloaded, expires_at)
+        self._ready = OrderedDict()
+        self._outstanding = 0
+        self.scheduled = 0
+        self.skipped = 0
+        self.completed = 0
+        self.failed = 0
+        self.hits = 0
+        self.late_hits = 0
+        self.wasted = 0
+        self.wasted_bytes = 0
+
+    def _expire(self):
+        now = time.time()
+        while self._ready:
+            key, (_, size, expires_at) = next(iter(self._ready.items()))
+            if expires_at > now:
+                break
+            del self._ready[key]
+            self._outstanding -= size
+            self.wasted += 1
+            self.wasted_bytes += size
+
+    def schedule(self, urls, max_length=2000):
+        """Start prefetching urls that are not cached, in flight or over budget"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._expire()
+        for url in urls:
+            url, key = page_key(url, max_length)
+            if key in self._inflight or key in self._ready:
+                continue
+            cached = page_cache.get(key)
+            if cached is not None and cached.is_fresh():
+                continue
+            if self._outstanding + self.max_page_bytes > self.budget_bytes:
+                self.skipped += 1
+                continue
+            # Reserve the largest possible download until the real size is known
+            self._outstanding += self.max_page_bytes
+            self.scheduled += 1
+            self._inflight[key] = asyncio.ensure_future(self._fetch(url, key, max_length))
+
+    async def _fetch(self, url, key, max_length):
+        downloaded = 0
+        try:
+            async with self._semaphore:
+                async with get_http_client().stream("GET", url, timeout=10) as response:
+                    response.raise_for_status()
+                    if check_response_headers(response.headers):
+                        self.failed += 1
+                        return
+                    content = await read_content(response, max_length, self.max_page_bytes)
+                    downloaded = response.num_bytes_downloaded
+            page_cache.put(key, content, response.headers)
+            # Kept here as well, pages the cache may not store can still be used once
+            self._ready[key] = (content, downloaded, time.time() + self.ttl)
+            self.completed += 1
+        except Exception as e:
+            print(f"Prefetch of {url} failed: {str(e)}")
+            self.failed += 1
+            downloaded = 0
+        finally:
+            self._outstanding += downloaded - self.max_page_bytes
+            del self._inflight[key]
+
+    async def take(self, key):
+        """Return prefetched content for a page cache key, waiting for an in-flight fetch, or None"""
+        late = False
+        task = self._inflight.get(key)
+        if task is not None:
+            late = True
+            await asyncio.shield(task)
+        self._expire()
+        ready = self._ready.pop(key, None)
+        if ready is None:
+            return None
+        content, size, _ = ready
+        self._outstanding -= size
+        if late:
+            self.late_hits += 1
+        else:
+            self.hits += 1
+        return content
+
+    def stats(self):
+        used = self.hits + self.late_hits
+        return {
+            "scheduled": self.scheduled,
+            "skipped_over_budget": self.skipped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "late_hits": self.late_hits,
+            "wasted": self.wasted,
+            "wasted_bytes": self.wasted_bytes,
+            "outstanding_bytes": self._outstanding,
+            "hit_ratio": round(used / self.completed, 4) if self.completed else 0.0,
+            "waste_ratio": round(self.wasted / (used + self.wasted), 4) if used + self.wasted else 0.0,
+        }
+
+prefetcher = Prefetcher(PREFETCH_CONCURRENCY, PREFETCH_BUDGET_BYTES, PREFETCH_MAX_PAGE_BYTES, PREFETCH_TTL)
+metrics.register_gauge("prefetch", prefetcher.stats)
+
+def prefetch_pages(urls, max_length=2000):
+    """Start background fetches of urls into the prefetch area; call on the event loop"""
+    prefetcher.schedule(urls, max_length)
+
+async def browse_website_async(url, max_length=2000, deadline=None):
     """
     Browse a website and extract meaningful content.
     Returns tuple: (success boolean, content or error message)
+
+    :param deadline: time.monotonic() value by which the download must finish
     """
     try:
-        # Add scheme if not present
-        if not url.startswith(('http://', 'https://')):
-            url = 'https://' + url
+        url, key = page_key(url, max_length)
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Remove unwanted elements
-        for element in soup(['script', 'style', 'nav', 'footer', 'iframe']):
-            element.decompose()
-        
-        # Extract title
-        title = soup.title.string if soup.title else "No title found"
-        
-        # Extract main content
-        main_content = []
-        
-        # Try to find main content containers
-        content_elements = soup.find_all(['article', 'main', 'div'], class_=re.compile(r'content|main|article'))
-        if not content_elements:
-            content_elements = soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
-        
-        for element in content_elements:
-            text = clean_text(element.get_text())
-            if text and len(text) > 50:  # Only include substantial content
-                main_content.append(text)
-        
-        # Combine and truncate content
-        content = f"Title: {title}\n\nContent:\n" + "\n".join(main_content)
-        if len(content) > max_length:
-            content = content[:max_length] + "... (content truncated)"
-            
+        prefetched = await prefetcher.take(key)
+        if prefetched is not None:
+            return True, prefetched
+
+        cached = page_cache.get(key)
+        if cached is not None and cached.is_fresh():
+            page_cache.record("hit")
+            return True, cached.content
+
+        if timeout_for(10, deadline) <= 0:
+            metrics.inc("browse.deadline_exceeded")
+            return False, "Website not loaded: out of time for this message."
+
+        headers = cached.validators() if cached is not None else {}
+        async with get_http_client().stream("GET", url, headers=headers, timeout=timeout_for(10, deadline)) as response:
+            if response.status_code == 304 and cached is not None:
+                # Not modified, reuse the extracted text without parsing again
+                page_cache.refresh(key, response.headers)
+                page_cache.record("revalidated")
+                return True, cached.content
+            response.raise_for_status()
+            page_cache.record("miss")
+
+            error = check_response_headers(response.headers)
+            if error:
+                return False, error
+            content = await read_content(response, max_length)
+
+        page_cache.put(key, content, response.headers)
         return True, content
-        
-    except requests.exceptions.RequestException as e:
+
+    except httpx.HTTPError as e:
         return False, f"Error accessing website: {str(e)}"
     except Exception as e:
         return False, f"Error processing website content: {str(e)}"
+
+def browse_website(url, max_length=2000):
+    """Synchronous wrapper around browse_website_async"""
+    return run_sync(browse_website_async(url, max_length))
@@ -0,0 +1,120 @@
+import json, sqlite3, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a fixed TTL.
+
+    If `path` is given, entries are also written to a SQLite file so they
+    survive restarts; the in-memory LRU sits in front of it. Values must be
+    JSON serializable when the disk tier is used.
+    """
+
+    def __init__(self, max_size: int = 500, ttl: float = 3600, path: str = None, name: str = "cache"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for key, or None if it is missing or expired"""
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        conn = self._disk()
+        if conn is not None:
+            try:
+                row = conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+                if row and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    with self._lock:
+                        self.hits += 1
+                        self.disk_hits += 1
+                    return value
+            except Exception as e:
+                print(f"Error reading {self.name} disk cache: {str(e)}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key: str, value: Any, expires: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        """Store a value, overriding the default TTL if ttl is given"""
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires)
+
+        conn = self._disk()
+        if conn is not None:
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires)
+                )
+                conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+            except Exception as e:
+                print(f"Error writing {self.name} disk cache: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        """Remove a key from both tiers"""
+        with self._lock:
+            self._entries.pop(key, None)
+        conn = self._disk()
+        if conn is not None:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        conn = self._disk()
+        if conn is not None:
+            conn.execute("DELETE FROM cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
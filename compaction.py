@@ -0,0 +1,228 @@
+"""
+Compact the chat memory: trim stale tool outputs, move inactive senders to
+the compressed archive and delete senders past the retention period.
+
+Usage:
+    python compaction.py [--dry-run] [--vacuum]
+
+Set COMPACTION_INTERVAL to also run it in the background of the bot; with
+several worker processes only one of them runs it. Every sender is compacted
+under the lock its turns hold, so senders whose turn is running in any
+process, the bot's or this script's, are left for the next pass.
+"""
+import argparse, glob, json, os, threading, time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import metrics
+from memory import get_store, get_archive, flush_chat_memory, invalidate_chat_memory, cache_stats
+from shared import SenderLocks, hold_file_lock_forever
+from storage import MemoryStore, ArchiveStore
+from config import (MEMORY_BACKEND, MEMORY_FILE, MEMORY_DB, MEMORY_ARCHIVE_DB, MEMORY_RETENTION_DAYS,
+                    MEMORY_ARCHIVE_AFTER_DAYS, TOOL_OUTPUT_RETENTION_HOURS, COMPRESSED_TOOL_OUTPUT_CHARS,
+                    COMPACTION_INTERVAL, SHARED_STATE, LOCK_DIR)
+
+TRIMMED_SUFFIX = "... (older tool output truncated)"
+
+_job: Optional[threading.Thread] = None
+
+def _parse_time(entry: Dict[str, Any]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(entry.get("timestamp", ""))
+    except (TypeError, ValueError):
+        return None
+
+def last_active(entries: List[Dict[str, Any]]) -> Optional[datetime]:
+    """Time of the newest entry that carries a timestamp"""
+    for entry in reversed(entries):
+        parsed = _parse_time(entry)
+        if parsed is not None:
+            return parsed
+    return None
+
+def trim_tool_outputs(entries: List[Dict[str, Any]], older_than: datetime,
+                      chars: int = COMPRESSED_TOOL_OUTPUT_CHARS) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Cut tool outputs written before older_than down to `chars` characters
+
+    :return: The entries and the number of outputs that were trimmed
+    """
+    trimmed = 0
+    result = []
+    for entry in entries:
+        content = entry.get("content", "")
+        written_at = _parse_time(entry)
+        if (entry.get("type") == "tool_output" and written_at is not None and written_at < older_than
+                and len(content) > chars + len(TRIMMED_SUFFIX)):
+            entry = dict(entry, content=content[:chars] + TRIMMED_SUFFIX)
+            trimmed += 1
+        result.append(entry)
+    return result, trimmed
+
+def disk_bytes() -> Dict[str, int]:
+    """Size on disk of the memory store and the archive, including SQLite WAL files"""
+    store_path = MEMORY_DB if MEMORY_BACKEND == "sqlite" else MEMORY_FILE
+    sizes = {}
+    for name, path in (("store", store_path), ("archive", MEMORY_ARCHIVE_DB)):
+        sizes[name] = sum(os.path.getsize(p) for p in glob.glob(glob.escape(path) + "*") if not p.endswith(".lock"))
+    return sizes
+
+def _compact_sender(store: MemoryStore, archive: Optional[ArchiveStore], sender_id: str,
+                    cutoffs: Dict[str, Optional[datetime]], report: Dict[str, Any], dry_run: bool) -> None:
+    # Entries this process still buffers belong to the history being compacted
+    flush_chat_memory(sender_id)
+    entries = store.load(sender_id)
+    if not entries:
+        return
+    report["senders"] += 1
+    report["entries_before"] += len(entries)
+    # What loading the sender materializes, roughly
+    report["json_bytes_before"] += len(json.dumps(entries, ensure_ascii=False))
+    active_at = last_active(entries)
+
+    if active_at is not None and cutoffs["retention"] is not None and active_at < cutoffs["retention"]:
+        report["expired"] += 1
+        if not dry_run:
+            store.delete(sender_id)
+            invalidate_chat_memory(sender_id)
+        return
+
+    if active_at is not None and cutoffs["archive"] is not None and active_at < cutoffs["archive"]:
+        report["archived"] += 1
+        if not dry_run:
+            archive.put(sender_id, entries, active_at.timestamp())
+            store.delete(sender_id)
+            invalidate_chat_memory(sender_id)
+        return
+
+    if cutoffs["tool"] is not None:
+        entries, trimmed = trim_tool_outputs(entries, cutoffs["tool"])
+        if trimmed:
+            report["tool_outputs_trimmed"] += trimmed
+            if not dry_run:
+                store.replace(sender_id, entries)
+                # The next turn reads the trimmed history
+                invalidate_chat_memory(sender_id)
+    report["entries_after"] += len(entries)
+    report["json_bytes_after"] += len(json.dumps(entries, ensure_ascii=False))
+
+def compact(store: MemoryStore = None, archive: ArchiveStore = None, now: datetime = None,
+            dry_run: bool = False, vacuum: bool = False,
+            sender_locks: Optional[SenderLocks] = None) -> Dict[str, Any]:
+    """
+    Run one compaction pass over every sender
+
+    :param dry_run: Only report what would change
+    :param vacuum: Also rewrite the SQLite files so the freed space is returned
+    :param sender_locks: Locks the bot's turns hold, defaults to the ones in LOCK_DIR;
+        senders whose lock is taken are skipped
+    :return: Counts of what was done and the footprint before and after
+    """
+    store = store or get_store()
+    archive = archive if archive is not None else get_archive()
+    sender_locks = sender_locks or SenderLocks(LOCK_DIR)
+    now = now or datetime.now()
+    cutoffs = {
+        "retention": now - timedelta(days=MEMORY_RETENTION_DAYS) if MEMORY_RETENTION_DAYS > 0 else None,
+        "archive": now - timedelta(days=MEMORY_ARCHIVE_AFTER_DAYS) if archive is not None else None,
+        "tool": now - timedelta(hours=TOOL_OUTPUT_RETENTION_HOURS) if TOOL_OUTPUT_RETENTION_HOURS > 0 else None,
+    }
+
+    report = {
+        "disk_bytes_before": disk_bytes(),
+        "cache_before": cache_stats(),
+        "senders": 0,
+        "entries_before": 0,
+        "entries_after": 0,
+        "json_bytes_before": 0,
+        "json_bytes_after": 0,
+        "expired": 0,
+        "archived": 0,
+        "tool_outputs_trimmed": 0,
+        "skipped_active": 0,
+    }
+    started_at = time.monotonic()
+
+    for sender_id in store.senders():
+        # A turn holding the lock may flush new rows at any moment
+        with sender_locks.hold(sender_id, blocking=False) as acquired:
+            if not acquired:
+                report["skipped_active"] += 1
+                continue
+            _compact_sender(store, archive, sender_id, cutoffs, report, dry_run)
+
+    if archive is not None and cutoffs["retention"] is not None and not dry_run:
+        report["archive_expired"] = archive.expire(cutoffs["retention"].timestamp())
+    if not dry_run:
+        store.compact(vacuum)
+        if archive is not None:
+            archive.compact(vacuum)
+            report["archive"] = archive.stats()
+
+    report["disk_bytes_after"] = disk_bytes()
+    report["cache_after"] = cache_stats()
+    report["seconds"] = round(time.monotonic() - started_at, 3)
+
+    metrics.inc("compaction.runs")
+    metrics.inc("compaction.expired", report["expired"])
+    metrics.inc("compaction.archived", report["archived"])
+    metrics.inc("compaction.tool_outputs_trimmed", report["tool_outputs_trimmed"])
+    metrics.observe("compaction.seconds", report["seconds"])
+    return report
+
+def format_report(report: Dict[str, Any]) -> str:
+    kib = 1024
+    before, after = report["disk_bytes_before"], report["disk_bytes_after"]
+    lines = [
+        f"Senders scanned: {report['senders']} (skipped {report['skipped_active']} active)",
+        f"Expired: {report['expired']}, archived: {report['archived']}, "
+        f"tool outputs trimmed: {report['tool_outputs_trimmed']}",
+        f"Entries in store: {report['entries_before']} -> {report['entries_after']}",
+        f"History as loaded (JSON): {report['json_bytes_before'] / kib:.1f} KiB -> {report['json_bytes_after'] / kib:.1f} KiB",
+        f"Store on disk: {before['store'] / kib:.1f} KiB -> {after['store'] / kib:.1f} KiB",
+        f"Archive on disk: {before['archive'] / kib:.1f} KiB -> {after['archive'] / kib:.1f} KiB",
+        f"History cache in RAM: {report['cache_before']['entries']} entries, "
+        f"{report['cache_before']['content_bytes'] / kib:.1f} KiB -> "
+        f"{report['cache_after']['entries']} entries, {report['cache_after']['content_bytes'] / kib:.1f} KiB",
+    ]
+    if "archive" in report:
+        lines.append(f"Archive: {report['archive']['senders']} senders, {report['archive']['entries']} entries, "
+                     f"{report['archive']['compressed_bytes'] / kib:.1f} KiB compressed")
+    return "\n".join(lines)
+
+def start_compaction_job(interval: float = COMPACTION_INTERVAL) -> None:
+    """Run compact() every `interval` seconds in a background thread of one process"""
+    global _job
+    if _job is not None or interval <= 0:
+        return
+
+    def run():
+        # Every worker process starts the job, the first to claim the lock
+        # runs it until it exits and the others stand by
+        leader = not SHARED_STATE
+        while True:
+            time.sleep(interval)
+            if not leader:
+                os.makedirs(LOCK_DIR, exist_ok=True)
+                leader = hold_file_lock_forever(os.path.join(LOCK_DIR, "compaction"))
+                if not leader:
+                    continue
+            try:
+                print("Memory compaction:\n" + format_report(compact()))
+            except Exception as e:
+                print(f"Error compacting chat memory: {str(e)}")
+
+    _job = threading.Thread(target=run, name="memory-compaction", daemon=True)
+    _job.start()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Trim, archive and expire chat memory")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without changing it")
+    parser.add_argument("--vacuum", action="store_true", help="rewrite the SQLite files to return freed space")
+    args = parser.parse_args()
+
+    report = compact(dry_run=args.dry_run, vacuum=args.vacuum)
+    print(format_report(report))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,173 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+# Containers that get their settings from the environment can skip reading
+# .env (and importing python-dotenv) with LOAD_DOTENV=0
+if os.environ.get("LOAD_DOTENV", "1") == "1":
+    from dotenv import load_dotenv
+    load_dotenv()
 
 VERIFY_TOKEN = os.environ.get("VERIFY_TOKEN")
 PAGE_ACCESS_TOKEN = os.environ.get("PAGE_ACCESS_TOKEN")
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+# Upstream endpoints, overridable to point the bot at local stand-ins (see benchmarks/loadtest.py)
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL") or None
+SEARCH_URL = os.environ.get("SEARCH_URL", "https://html.duckduckgo.com/html/")
 MEMORY_FILE = "chat_memory.json"
-MAX_MEMORY = 15
\ No newline at end of file
+MAX_MEMORY = 15
+# 'sqlite' (default) or 'json' for the legacy single-file store
+MEMORY_BACKEND = os.environ.get("MEMORY_BACKEND", "sqlite")
+MEMORY_DB = os.environ.get("MEMORY_DB", "chat_memory.db")
+# Write-behind cache of hot senders' histories (0 disables it)
+MEMORY_CACHE_SIZE = int(os.environ.get("MEMORY_CACHE_SIZE", 1000))
+MEMORY_CACHE_TTL = float(os.environ.get("MEMORY_CACHE_TTL", 600))
+MEMORY_FLUSH_INTERVAL = float(os.environ.get("MEMORY_FLUSH_INTERVAL", 5))
+
+# Background message processing
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", 8))
+# Run turns as coroutines on a shared event loop instead of one thread each
+ASYNC_PIPELINE = os.environ.get("ASYNC_PIPELINE", "1") == "1"
+MAX_IN_FLIGHT_TURNS = int(os.environ.get("MAX_IN_FLIGHT_TURNS", 200))
+# Stream LLM output so progress messages and tool calls act on their closing tag
+LLM_STREAMING = os.environ.get("LLM_STREAMING", "1") == "1"
+MAX_PENDING_MESSAGES = int(os.environ.get("MAX_PENDING_MESSAGES", 1000))
+MAX_PENDING_PER_SENDER = int(os.environ.get("MAX_PENDING_PER_SENDER", 20))
+
+# Duplicate suppression and rate limits for starting new turns
+DEDUP_TTL = float(os.environ.get("DEDUP_TTL", 600))
+SENDER_RATE_PER_MINUTE = float(os.environ.get("SENDER_RATE_PER_MINUTE", 6))
+SENDER_BURST = float(os.environ.get("SENDER_BURST", 3))
+GLOBAL_RATE_PER_SECOND = float(os.environ.get("GLOBAL_RATE_PER_SECOND", 2))
+GLOBAL_BURST = float(os.environ.get("GLOBAL_BURST", 20))
+BUSY_REPLY_COOLDOWN = float(os.environ.get("BUSY_REPLY_COOLDOWN", 30))
+
+# Pooled HTTP client for search, browsing and the Send API
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", 20))
+
+# Web search result cache (SEARCH_CACHE_FILE enables the on-disk tier)
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 500))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 3600))
+SEARCH_CACHE_FILE = os.environ.get("SEARCH_CACHE_FILE", "")
+# Results shown to the model per search, after deduplication and ranking
+SEARCH_RESULT_LIMIT = int(os.environ.get("SEARCH_RESULT_LIMIT", 5))
+SEARCH_RESULTS_MAX_CHARS = int(os.environ.get("SEARCH_RESULTS_MAX_CHARS", 1800))
+# Snippet shingle overlap at which two results count as the same
+SEARCH_SNIPPET_SIMILARITY = float(os.environ.get("SEARCH_SNIPPET_SIMILARITY", 0.6))
+
+# Extracted page text cache for browse_url
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+# Freshness for pages that send no caching headers at all
+PAGE_CACHE_DEFAULT_TTL = float(os.environ.get("PAGE_CACHE_DEFAULT_TTL", 300))
+
+# HTML extraction engine: 'stream' (single-pass parser) or 'bs4' (BeautifulSoup)
+HTML_EXTRACTOR = os.environ.get("HTML_EXTRACTOR", "stream")
+# Hard cap on the bytes downloaded for one browse_url call
+BROWSE_MAX_BYTES = int(os.environ.get("BROWSE_MAX_BYTES", 2 * 1024 * 1024))
+
+# Run every tool call from one response concurrently (opt-in)
+PARALLEL_TOOLS = os.environ.get("PARALLEL_TOOLS", "0") == "1"
+MAX_PARALLEL_TOOLS = int(os.environ.get("MAX_PARALLEL_TOOLS", 4))
+TOOL_CALL_TIMEOUT = float(os.environ.get("TOOL_CALL_TIMEOUT", 15))
+TOOL_TOTAL_TIMEOUT = float(os.environ.get("TOOL_TOTAL_TIMEOUT", 25))
+
+# Prompt assembly
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 6000))
+CONTEXT_RECENT_MESSAGES = int(os.environ.get("CONTEXT_RECENT_MESSAGES", 8))
+COMPRESSED_TOOL_OUTPUT_CHARS = int(os.environ.get("COMPRESSED_TOOL_OUTPUT_CHARS", 400))
+# Rolling per-sender summary of turns older than the recent window
+CONTEXT_SUMMARIES = os.environ.get("CONTEXT_SUMMARIES", "1") == "1"
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", 5000))
+SUMMARY_CACHE_TTL = float(os.environ.get("SUMMARY_CACHE_TTL", 7 * 24 * 3600))
+SUMMARY_CACHE_FILE = os.environ.get("SUMMARY_CACHE_FILE", "")
+# Messages that must have left the recent window before the summary is refreshed with an LLM call
+SUMMARY_MIN_NEW_ENTRIES = int(os.environ.get("SUMMARY_MIN_NEW_ENTRIES", max(1, CONTEXT_RECENT_MESSAGES // 2)))
+
+# Send API
+GRAPH_API_URL = os.environ.get("GRAPH_API_URL", "https://graph.facebook.com/v18.0/me/messages")
+SEND_TIMEOUT = float(os.environ.get("SEND_TIMEOUT", 10))
+SEND_MAX_RETRIES = int(os.environ.get("SEND_MAX_RETRIES", 3))
+SEND_RETRY_BACKOFF = float(os.environ.get("SEND_RETRY_BACKOFF", 0.5))
+TYPING_INDICATOR = os.environ.get("TYPING_INDICATOR", "1") == "1"
+TYPING_REFRESH_INTERVAL = float(os.environ.get("TYPING_REFRESH_INTERVAL", 15))
+
+# Reuse final answers for similar standalone questions (opt-in)
+ANSWER_CACHE = os.environ.get("ANSWER_CACHE", "0") == "1"
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", 2000))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 6 * 3600))
+# IDF-weighted cosine similarity a question needs to reuse a cached answer,
+# once its numbers and rare words are found in the cached one. Calibrated on
+# near-miss pairs ("2018" vs "2022 world cup", "C++" vs "C#") and rephrasings
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.78))
+# Shorter messages ("thanks", "and him?") depend on the conversation
+ANSWER_CACHE_MIN_WORDS = int(os.environ.get("ANSWER_CACHE_MIN_WORDS", 4))
+
+# Log a per-stage latency breakdown after every turn
+TRACE_TURNS = os.environ.get("TRACE_TURNS", "1") == "1"
+# Sample the turns of this sender with the stack profiler (also settable via /profile)
+PROFILE_SENDER = os.environ.get("PROFILE_SENDER", "")
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+# Production serving (gunicorn.conf.py)
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", 1))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", 8))
+# Seconds a stopping worker waits for queued and running turns to finish
+DRAIN_TIMEOUT = float(os.environ.get("DRAIN_TIMEOUT", 30))
+# Keep rate limits, dedupe and per-sender ordering in files shared by all
+# worker processes; on by default with more than one worker
+SHARED_STATE = os.environ.get("SHARED_STATE", "1" if WEB_WORKERS > 1 else "0") == "1"
+SHARED_STATE_DB = os.environ.get("SHARED_STATE_DB", "shared_state.db")
+LOCK_DIR = os.environ.get("LOCK_DIR", "locks")
+if SHARED_STATE:
+    # In-process caches would diverge between workers, share their disk tier
+    SEARCH_CACHE_FILE = SEARCH_CACHE_FILE or "search_cache.db"
+    SUMMARY_CACHE_FILE = SUMMARY_CACHE_FILE or "summary_cache.db"
+
+# Fetch the top search results in the background before the model asks for them (opt-in)
+PREFETCH = os.environ.get("PREFETCH", "0") == "1"
+PREFETCH_TOP_N = int(os.environ.get("PREFETCH_TOP_N", 2))
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", 4))
+# Bytes prefetching may have outstanding: in-flight downloads plus pages not used yet
+PREFETCH_BUDGET_BYTES = int(os.environ.get("PREFETCH_BUDGET_BYTES", 4 * 1024 * 1024))
+PREFETCH_MAX_PAGE_BYTES = int(os.environ.get("PREFETCH_MAX_PAGE_BYTES", 512 * 1024))
+# Prefetched pages not browsed within this many seconds count as wasted
+PREFETCH_TTL = float(os.environ.get("PREFETCH_TTL", 120))
+
+# Models: tool selection and small talk go to the small model, synthesis to
+# the large one; the fallbacks are tried on rate limits, timeouts and outages
+LARGE_MODEL = os.environ.get("LARGE_MODEL", "meta-llama/llama-4-maverick-17b-128e-instruct")
+SMALL_MODEL = os.environ.get("SMALL_MODEL", "llama-3.1-8b-instant")
+FALLBACK_MODELS = [m.strip() for m in os.environ.get("FALLBACK_MODELS", "llama-3.3-70b-versatile").split(",") if m.strip()]
+MODEL_ROUTING = os.environ.get("MODEL_ROUTING", "1") == "1"
+# Messages up to this many words are small talk the small model may answer;
+# its answers to longer ones are written again by the large model
+SMALL_TALK_MAX_WORDS = int(os.environ.get("SMALL_TALK_MAX_WORDS", 6))
+# Seconds a rate limited model is skipped when Groq sends no Retry-After
+MODEL_COOLDOWN = float(os.environ.get("MODEL_COOLDOWN", 30))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 30))
+# Total seconds of LLM calls one turn may take
+TURN_LATENCY_BUDGET = float(os.environ.get("TURN_LATENCY_BUDGET", 60))
+# End-to-end seconds for a turn: LLM calls, tools and replies. When it runs
+# out the turn answers with what it has found so far
+TURN_DEADLINE = float(os.environ.get("TURN_DEADLINE", 90))
+# Part of the deadline kept for sending that answer
+TURN_DEADLINE_RESERVE = float(os.environ.get("TURN_DEADLINE_RESERVE", 5))
+DEGRADED_ANSWER_CHARS = int(os.environ.get("DEGRADED_ANSWER_CHARS", 700))
+# A new message from the sender interrupts the running LLM call or tool and
+# the turn continues with it; with 0 it is folded in after the current step
+INTERRUPT_ON_NEW_MESSAGE = os.environ.get("INTERRUPT_ON_NEW_MESSAGE", "1") == "1"
+
+# Load the Groq SDK, clients and stores in the background once the server is
+# listening, so the first message does not pay for them
+PREWARM = os.environ.get("PREWARM", "1") == "1"
+
+# Chat history retention (compaction.py): senders inactive for this many days
+# are deleted, 0 keeps them forever
+MEMORY_RETENTION_DAYS = float(os.environ.get("MEMORY_RETENTION_DAYS", 180))
+# Inactive senders are moved to the compressed archive after this many days, 0 disables archiving
+MEMORY_ARCHIVE_AFTER_DAYS = float(os.environ.get("MEMORY_ARCHIVE_AFTER_DAYS", 14))
+MEMORY_ARCHIVE_DB = os.environ.get("MEMORY_ARCHIVE_DB", "chat_archive.db")
+# Tool outputs older than this are cut down to COMPRESSED_TOOL_OUTPUT_CHARS, 0 keeps them
+TOOL_OUTPUT_RETENTION_HOURS = float(os.environ.get("TOOL_OUTPUT_RETENTION_HOURS", 24))
+# Run compaction in the background every this many seconds, 0 only runs it from the command line
+COMPACTION_INTERVAL = float(os.environ.get("COMPACTION_INTERVAL", 0))
@@ -0,0 +1,193 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache import TTLCache
+from llm import query_llm_async, router
+from router import SUMMARY
+from memory import get_chat_history
+import metrics
+from config import (CONTEXT_TOKEN_BUDGET, CONTEXT_RECENT_MESSAGES, CONTEXT_SUMMARIES, MAX_MEMORY,
+                    COMPRESSED_TOOL_OUTPUT_CHARS, SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL, SUMMARY_CACHE_FILE,
+                    SUMMARY_MIN_NEW_ENTRIES)
+
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """Summarize the conversation below between a user and an assistant in at most 120 words.
+Keep names, facts, numbers, open questions and the user's preferences. Leave out greetings and filler.
+If an earlier summary is given, merge it with the new messages into one summary."""
+
+summary_cache = TTLCache(SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL, SUMMARY_CACHE_FILE or None, name="summary_cache")
+metrics.register_gauge("summary_cache", summary_cache.stats)
+
+_background_tasks = set()
+
+def count_tokens(text: str) -> int:
+    """Approximate token count (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+def context_item(role: str, content: str, kind: str) -> Dict[str, str]:
+    """
+    A message in the context together with its kind, which decides what is
+    compressed or dropped first: 'system', 'summary', 'history', 'tool' or 'user'
+    """
+    return {"role": role, "content": content, "kind": kind}
+
+def _history_to_items(entries: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    items = []
+    for msg in entries:
+        if msg.get("content") and msg.get("role") in ["user", "assistant"]:
+            # Don't include progress messages in context
+            if msg.get("type") != "message" or "Let me" not in msg["content"]:
+                kind = "tool" if msg.get("type") == "tool_output" else "history"
+                items.append(context_item(msg["role"], msg["content"], kind))
+    return items
+
+def build_context(sender_id: str, system_prompt: str, chat_history: List[Dict[str, Any]],
+                  user_message: str) -> List[Dict[str, str]]:
+    """
+    Build the context items for a turn: system prompt, cached summary of older
+    turns, recent history and the new user message. Reads the summary cache,
+    whose disk tier may block, so call it off the event loop.
+    """
+    items = [context_item("system", system_prompt, "system")]
+
+    older = chat_history[:-CONTEXT_RECENT_MESSAGES] if len(chat_history) > CONTEXT_RECENT_MESSAGES else []
+    recent = chat_history[-CONTEXT_RECENT_MESSAGES:] if chat_history else []
+
+    if older and CONTEXT_SUMMARIES:
+        cached = summary_cache.get(sender_id)
+        if cached and cached.get("summary"):
+            items.append(context_item("system", f"Summary of the earlier conversation:\n{cached['summary']}", "summary"))
+
+    items.extend(_history_to_items(recent))
+    items.append(context_item("user", user_message, "user"))
+    return items
+
+def _tokens(item: Dict[str, str]) -> int:
+    return count_tokens(item["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+def _compress(content: str, chars: int) -> str:
+    if len(content) <= chars:
+        return content
+    return content[:chars] + "... (older tool output truncated)"
+
+def assemble(items: List[Dict[str, str]], budget: int = CONTEXT_TOKEN_BUDGET) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Turn context items into LLM messages that fit in the token budget
+
+    When over budget, older tool outputs are compressed and then dropped
+    (oldest first), then the oldest history messages are dropped, and as a
+    last resort the newest tool output is truncated. The system prompt,
+    summary and user messages are always kept.
+
+    :return: The messages and their approximate token count
+    """
+    items = [dict(item) for item in items]
+    total = sum(_tokens(item) for item in items)
+
+    tool_indexes = [i for i, item in enumerate(items) if item["kind"] == "tool"]
+    older_tools = tool_indexes[:-1]
+
+    for i in older_tools:
+        if total <= budget:
+            break
+        before = _tokens(items[i])
+        items[i]["content"] = _compress(items[i]["content"], COMPRESSED_TOOL_OUTPUT_CHARS)
+        total -= before - _tokens(items[i])
+
+    dropped = set()
+    for i in older_tools:
+        if total <= budget:
+            break
+        total -= _tokens(items[i])
+        dropped.add(i)
+
+    for i, item in enumerate(items):
+        if total <= budget:
+            break
+        if item["kind"] == "history":
+            total -= _tokens(item)
+            dropped.add(i)
+
+    if total > budget and tool_indexes:
+        newest = items[tool_indexes[-1]]
+        before = _tokens(newest)
+        keep_chars = max(COMPRESSED_TOOL_OUTPUT_CHARS, (before - (total - budget)) * 4)
+        newest["content"] = _compress(newest["content"], keep_chars)
+        total -= before - _tokens(newest)
+
+    messages = [
+        {"role": item["role"], "content": item["content"]}
+        for i, item in enumerate(items) if i not in dropped
+    ]
+    return messages, total
+
+async def refresh_summary(sender_id: str, allow: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Fold history that has fallen out of the recent window into the sender's
+    rolling summary. Only messages newer than the cached summary are sent to
+    the LLM, once there are SUMMARY_MIN_NEW_ENTRIES of them.
+
+    :param allow: Rate limit check for the LLM call, may block; the refresh
+        is left for a later turn if it returns False
+    """
+    try:
+        chat_history = await asyncio.to_thread(get_chat_history, sender_id)
+        if len(chat_history) <= CONTEXT_RECENT_MESSAGES:
+            return
+        older = chat_history[:-CONTEXT_RECENT_MESSAGES]
+
+        cached = await asyncio.to_thread(summary_cache.get, sender_id) or {}
+        upto = cached.get("upto", "")
+        new_entries = [e for e in older if e.get("timestamp", "") > upto]
+        # Older entries are trimmed past MAX_MEMORY, do not wait for more than fit
+        if not new_entries or len(new_entries) < min(SUMMARY_MIN_NEW_ENTRIES, MAX_MEMORY - CONTEXT_RECENT_MESSAGES):
+            return
+
+        lines = []
+        for item in _history_to_items(new_entries):
+            content = item["content"]
+            if item["kind"] == "tool":
+                content = _compress(content, COMPRESSED_TOOL_OUTPUT_CHARS)
+            lines.append(f"{item['role']}: {content}")
+        if not lines:
+            return
+
+        prompt = ""
+        if cached.get("summary"):
+            prompt += f"Earlier summary:\n{cached['summary']}\n\n"
+        prompt += "New messages:\n" + "\n".join(lines)
+
+        # A summary can wait, unlike the turns competing for the same quota
+        if not router.available(SUMMARY) or (allow is not None and not await asyncio.to_thread(allow)):
+            metrics.inc("context.summaries_deferred")
+            return
+
+        summary = await query_llm_async(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": prompt}],
+            temperature=0.2,
+            max_tokens=256,
+            kind=SUMMARY
+        )
+        if summary:
+            await asyncio.to_thread(summary_cache.set, sender_id,
+                                    {"upto": new_entries[-1].get("timestamp", ""), "summary": summary})
+            metrics.inc("context.summaries")
+    except Exception as e:
+        print(f"Error refreshing summary for {sender_id}: {str(e)}")
+
+def schedule_summary_refresh(sender_id: str, allow: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Refresh the sender's summary in the background after a turn; must run on the event loop
+
+    :param allow: Rate limit check for the LLM call, see refresh_summary
+    """
+    if not CONTEXT_SUMMARIES:
+        return
+    task = asyncio.ensure_future(refresh_summary(sender_id, allow))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def clear_summary(sender_id: str) -> None:
+    """Forget the sender's summary, e.g. after /reset"""
+    summary_cache.delete(sender_id)
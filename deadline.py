@@ -0,0 +1,139 @@
+import asyncio, threading, time
+from typing import Any, Awaitable, Dict, Optional
+
+import metrics
+import tracing
+
+class DeadlineExceeded(Exception):
+    """The turn ran out of time"""
+
+class TurnInterrupted(Exception):
+    """A newer message from the sender arrived while a step was running"""
+
+class TurnCancelled(Exception):
+    """The turn was called off, e.g. by a /reset"""
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds until a time.monotonic() deadline, None if there is no deadline"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def timeout_for(default: float, deadline: Optional[float]) -> float:
+    """The default timeout, cut short by the deadline"""
+    left = remaining(deadline)
+    if left is None:
+        return default
+    return max(0.0, min(default, left))
+
+class TurnControl:
+    """
+    Deadline and interrupt signal of one running turn.
+
+    The turn runs its steps (LLM calls, tools) through run(), which cancels
+    the step when the deadline passes or interrupt() or cancel() is called.
+    Both may be called from any thread.
+    """
+
+    def __init__(self, deadline: float, loop: asyncio.AbstractEventLoop = None):
+        self.deadline = deadline
+        self._loop = loop or asyncio.get_running_loop()
+        self._interrupted = asyncio.Event()
+        self._cancelled = False
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def interrupt(self) -> None:
+        self._loop.call_soon_threadsafe(self._interrupted.set)
+
+    def cancel(self) -> None:
+        """End the turn: the running step and every later one raise TurnCancelled"""
+        def set_cancelled():
+            self._cancelled = True
+            self._interrupted.set()
+        self._loop.call_soon_threadsafe(set_cancelled)
+
+    def check(self) -> None:
+        """Raise TurnCancelled if the turn was cancelled; call between steps"""
+        if self._cancelled:
+            raise TurnCancelled()
+
+    def interrupted(self) -> bool:
+        return self._interrupted.is_set()
+
+    def reset(self) -> None:
+        """Acknowledge an interrupt; call on the event loop"""
+        self._interrupted.clear()
+
+    async def run(self, step: Awaitable, deadline: float = None, interruptible: bool = True) -> Any:
+        """
+        Await a step, cancelling it if the deadline passes or, if interruptible,
+        a newer message arrives
+
+        :param deadline: Earlier deadline for this step, defaults to the turn's
+        :raises DeadlineExceeded: The deadline passed first
+        :raises TurnInterrupted: interrupt() was called first
+        :raises TurnCancelled: cancel() was called first
+        """
+        deadline = min(deadline, self.deadline) if deadline is not None else self.deadline
+        task = asyncio.ensure_future(step)
+        tracing.track_task(task)
+        waiters = {task}
+        interrupt_waiter = None
+        if interruptible:
+            interrupt_waiter = asyncio.ensure_future(self._interrupted.wait())
+            waiters.add(interrupt_waiter)
+        try:
+            await asyncio.wait(waiters, timeout=max(0.0, deadline - time.monotonic()),
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if interrupt_waiter is not None:
+                interrupt_waiter.cancel()
+            if not task.done():
+                task.cancel()
+        if interruptible:
+            self.check()
+        if task.done() and not task.cancelled():
+            return task.result()
+        if interruptible and self._interrupted.is_set():
+            raise TurnInterrupted()
+        raise DeadlineExceeded()
+
+class TurnRegistry:
+    """Running turns by sender, so the webhook can interrupt or cancel them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._turns: Dict[str, TurnControl] = {}
+
+    def register(self, sender_id: str, control: TurnControl) -> None:
+        with self._lock:
+            self._turns[sender_id] = control
+
+    def unregister(self, sender_id: str, control: TurnControl) -> None:
+        with self._lock:
+            if self._turns.get(sender_id) is control:
+                del self._turns[sender_id]
+
+    def interrupt(self, sender_id: str) -> bool:
+        """Interrupt the sender's running turn; False if there is none"""
+        with self._lock:
+            control = self._turns.get(sender_id)
+        if control is None:
+            return False
+        metrics.inc("turns.interrupt_requests")
+        control.interrupt()
+        return True
+
+    def cancel(self, sender_id: str) -> bool:
+        """Cancel the sender's running turn; False if there is none"""
+        with self._lock:
+            control = self._turns.get(sender_id)
+        if control is None:
+            return False
+        control.cancel()
+        return True
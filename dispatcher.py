@@ -0,0 +1,235 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Set, Tuple
+
+import metrics
+from aio import submit as submit_coroutine
+
+class Dispatcher:
+    """
+    Bounded background worker pool for incoming messages.
+
+    Jobs from the same sender run one after another in the order they were
+    submitted, jobs from different senders run in parallel on the workers.
+    If the handler is a coroutine function, jobs run on the shared event loop
+    instead of worker threads and `workers` bounds how many are in flight.
+    """
+
+    def __init__(self, handler: Callable[..., Any], workers: int = 8, max_pending: int = 1000,
+                 max_pending_per_sender: int = 20, name: str = "dispatcher"):
+        """
+        :param handler: Called as handler(sender_id, *args) for every job
+        :param workers: Number of worker threads, or of concurrent coroutines for async handlers
+        :param max_pending: Maximum number of queued jobs across all senders
+        :param max_pending_per_sender: Maximum number of queued jobs for one sender
+        :param name: Prefix used for thread names and metrics
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_sender = max_pending_per_sender
+        self.name = name
+        self.is_async = asyncio.iscoroutinefunction(handler)
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[Tuple[float, tuple]]] = {}
+        self._ready: Deque[str] = deque()
+        self._active: Set[str] = set()
+        self._pending = 0
+        self._threads: List[threading.Thread] = []
+        self._accepting = True
+
+        metrics.register_gauge(f"{name}.queue_depth", lambda: self._pending)
+        metrics.register_gauge(f"{name}.in_flight", lambda: len(self._active))
+
+    def _ensure_started(self) -> None:
+        # Workers are started on first use so importing the module stays cheap
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, sender_id: str, *args: Any) -> bool:
+        """
+        Queue a job for a sender
+
+        :param sender_id: Jobs with the same sender_id are processed serially
+        :param args: Extra arguments passed to the handler
+        :return: False if the job was rejected because the queue is full or shutting down
+        """
+        with self._cond:
+            if not self._accepting:
+                metrics.inc(f"{self.name}.rejected")
+                return False
+            if self._pending >= self.max_pending:
+                metrics.inc(f"{self.name}.rejected")
+                return False
+
+            queue = self._queues.get(sender_id)
+            if queue is None:
+                queue = self._queues[sender_id] = deque()
+                self._ready.append(sender_id)
+            elif len(queue) >= self.max_pending_per_sender:
+                metrics.inc(f"{self.name}.rejected")
+                return False
+
+            queue.append((time.monotonic(), args))
+            self._pending += 1
+            metrics.inc(f"{self.name}.submitted")
+            if self.is_async:
+                self._launch_ready()
+            else:
+                self._ensure_started()
+                self._cond.notify()
+        return True
+
+    def _launch_ready(self) -> None:
+        # Caller holds self._cond
+        while self._ready and len(self._active) < self.workers:
+            sender_id = self._ready.popleft()
+            enqueued_at, args = self._queues[sender_id].popleft()
+            self._pending -= 1
+            self._active.add(sender_id)
+            submit_coroutine(self._run_async(sender_id, enqueued_at, args))
+
+    async def _run_async(self, sender_id: str, enqueued_at: float, args: tuple) -> None:
+        started_at = time.monotonic()
+        metrics.observe(f"{self.name}.queue_wait_seconds", started_at - enqueued_at)
+        try:
+            await self.handler(sender_id, *args)
+        except Exception as e:
+            print(f"Error in {self.name} for {sender_id}: {str(e)}")
+            metrics.inc(f"{self.name}.errors")
+        finally:
+            metrics.observe(f"{self.name}.run_seconds", time.monotonic() - started_at)
+            metrics.inc(f"{self.name}.completed")
+            self._finish(sender_id)
+
+    def _finish(self, sender_id: str) -> None:
+        with self._cond:
+            self._active.discard(sender_id)
+            if self._queues[sender_id]:
+                self._ready.append(sender_id)
+            else:
+                del self._queues[sender_id]
+            if self.is_async:
+                self._launch_ready()
+            self._cond.notify_all()
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready and self._accepting:
+                    self._cond.wait()
+                if not self._ready:
+                    return
+                sender_id = self._ready.popleft()
+                enqueued_at, args = self._queues[sender_id].popleft()
+                self._pending -= 1
+                self._active.add(sender_id)
+
+            started_at = time.monotonic()
+            metrics.observe(f"{self.name}.queue_wait_seconds", started_at - enqueued_at)
+            try:
+                self.handler(sender_id, *args)
+            except Exception as e:
+                print(f"Error in {self.name} worker for {sender_id}: {str(e)}")
+                metrics.inc(f"{self.name}.errors")
+            finally:
+                metrics.observe(f"{self.name}.run_seconds", time.monotonic() - started_at)
+                metrics.inc(f"{self.name}.completed")
+                self._finish(sender_id)
+
+    def shutdown(self, timeout: float = None) -> bool:
+        """
+        Stop accepting jobs and wait for queued and running jobs to finish
+
+        :param timeout: Maximum number of seconds to wait, None waits forever
+        :return: True if everything was drained before the timeout
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            self._accepting = False
+            self._cond.notify_all()
+            while self._pending or self._active:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Return current queue state"""
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "queue_depth": self._pending,
+                "in_flight": len(self._active),
+                "queued_senders": len(self._ready),
+                "max_pending": self.max_pending,
+                "accepting": self._accepting,
+            }
+
+class TurnCoalescer:
+    """
+    Tracks which senders have a turn queued or running, so messages that
+    arrive meanwhile are folded into that turn instead of starting another.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[str]] = {}
+
+    def open(self, sender_id: str) -> None:
+        """Mark that a turn has been queued for the sender"""
+        with self._lock:
+            self._pending.setdefault(sender_id, [])
+
+    def add(self, sender_id: str, text: str) -> bool:
+        """Add a message to the sender's open turn; False if there is none"""
+        with self._lock:
+            pending = self._pending.get(sender_id)
+            if pending is None:
+                return False
+            pending.append(text)
+            return True
+
+    def take(self, sender_id: str) -> List[str]:
+        """Return and forget the messages added since the last call"""
+        with self._lock:
+            pending = self._pending.get(sender_id)
+            if not pending:
+                return []
+            self._pending[sender_id] = []
+            return pending
+
+    def close(self, sender_id: str) -> List[str]:
+        """End the sender's turn and return messages it did not pick up"""
+        with self._lock:
+            return self._pending.pop(sender_id, None) or []
+
+    def hand_over(self, sender_id: str, submit: Callable[[str], bool]) -> bool:
+        """
+        End the sender's turn, passing the messages it did not pick up to
+        submit as the text of a new turn. This happens under the lock, so a
+        message arriving meanwhile joins that turn instead of overtaking it.
+
+        :return: False if submit rejected the messages; they are dropped
+        """
+        with self._lock:
+            pending = self._pending.pop(sender_id, None)
+            if not pending:
+                return True
+            if not submit("\n".join(pending)):
+                return False
+            # The new turn is queued, keep collecting messages for it
+            self._pending[sender_id] = []
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"open_turns": len(self._pending)}
@@ -0,0 +1,283 @@
+import re
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+SKIP_TAGS = {'script', 'style', 'nav', 'footer', 'iframe'}
+CONTAINER_TAGS = {'article', 'main', 'div'}
+CONTAINER_CLASS = re.compile(r'content|main|article')
+BLOCK_TAGS = {'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+MIN_SEGMENT_LENGTH = 50
+
+def clean_text(text):
+    # Remove extra whitespace and normalize
+    text = re.sub(r'\s+', ' ', text).strip()
+    # Remove scripts and style content
+    text = re.sub(r'<script.*?</script>', '', text, flags=re.DOTALL)
+    text = re.sub(r'<style.*?</style>', '', text, flags=re.DOTALL)
+    return text
+
+def format_content(title, segments, max_length):
+    """Combine the title and text segments and truncate the result"""
+    content = f"Title: {title}\n\nContent:\n" + "\n".join(segments)
+    if len(content) > max_length:
+        content = content[:max_length] + "... (content truncated)"
+    return content
+
+class _TreeParser(HTMLParser):
+    """
+    HTMLParser that keeps a stack of open elements so subclasses get
+    matching open/close callbacks, even for sloppy HTML with unclosed tags.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._stack = []
+
+    def handle_starttag(self, tag, attrs):
+        marker = self.open_element(tag, dict(attrs))
+        if tag not in VOID_TAGS:
+            self._stack.append((tag, marker))
+
+    def handle_startendtag(self, tag, attrs):
+        self.close_element(self.open_element(tag, dict(attrs)))
+
+    def handle_endtag(self, tag):
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i][0] == tag:
+                # Implicitly close everything opened inside it
+                while len(self._stack) > i:
+                    self.close_element(self._stack.pop()[1])
+                return
+
+    def open_element(self, tag, attrs):
+        return None
+
+    def close_element(self, marker):
+        pass
+
+class StreamingExtractor(_TreeParser):
+    """
+    Single-pass page text extractor. Feed it HTML in chunks; it keeps only
+    the text it needs and sets `done` once enough content has been found.
+
+    Mirrors extract_content_bs4: text of article/main/div elements whose
+    class mentions content, main or article is preferred, falling back to
+    paragraphs and headings. Nested containers are only counted once. Only
+    container text stops the parse early, once its cleaned length reaches
+    max_length, so the result does not depend on how the page is split into
+    chunks; pages without containers are read to the byte cap.
+    """
+
+    def __init__(self, max_length=2000):
+        super().__init__()
+        self.max_length = max_length
+        self.done = False
+        self._title = None
+        self._title_parts = None
+        self._skip_depth = 0
+        self._container_depth = 0
+        self._block_depth = 0
+        self._container_parts = []
+        self._block_parts = []
+        self._containers = []
+        self._blocks = []
+        self._container_chars = 0
+        # Cleaned length of the container still open, and whether its text
+        # so far ends in whitespace that clean_text turns into a space
+        self._open_container_chars = 0
+        self._open_container_space = False
+
+    def open_element(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip_depth += 1
+            return "skip"
+        if tag == "title" and self._title is None and self._title_parts is None:
+            self._title_parts = []
+            return "title"
+        if tag in CONTAINER_TAGS and CONTAINER_CLASS.search(attrs.get("class") or ""):
+            self._container_depth += 1
+            return "container"
+        if tag in BLOCK_TAGS:
+            self._block_depth += 1
+            return "block"
+        return None
+
+    def close_element(self, marker):
+        if marker == "skip":
+            self._skip_depth -= 1
+        elif marker == "title":
+            self._title = "".join(self._title_parts).strip()
+            self._title_parts = None
+        elif marker == "container":
+            self._container_depth -= 1
+            if self._container_depth == 0:
+                self._container_chars += self._add_segment(self._container_parts, self._containers)
+                self._open_container_chars = 0
+                self._open_container_space = False
+        elif marker == "block":
+            self._block_depth -= 1
+            if self._block_depth == 0:
+                self._add_segment(self._block_parts, self._blocks)
+        self._check_done()
+
+    def _add_segment(self, parts, segments):
+        text = clean_text("".join(parts))
+        parts.clear()
+        if text and len(text) > MIN_SEGMENT_LENGTH:  # Only include substantial content
+            segments.append(text)
+            return len(text) + 1
+        return 0
+
+    def _count_container_text(self, data):
+        """Add data to the cleaned length of the open container, across fragment boundaries"""
+        words = data.split()
+        if words:
+            if self._open_container_chars and (self._open_container_space or data[0].isspace()):
+                self._open_container_chars += 1
+            self._open_container_chars += sum(len(word) for word in words) + len(words) - 1
+            self._open_container_space = data[-1].isspace()
+        elif data:
+            self._open_container_space = True
+
+    def _check_done(self):
+        # Only container text can stop the parse: containers win over
+        # paragraphs, and one may still follow enough paragraph text. A
+        # container cut off while still too short to count would be dropped.
+        if (self._container_chars + self._open_container_chars >= self.max_length and
+                (not self._open_container_chars or self._open_container_chars > MIN_SEGMENT_LENGTH)):
+            self.done = True
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+        if self._block_depth:
+            self._block_parts.append(data)
+        if self._container_depth:
+            self._container_parts.append(data)
+            self._count_container_text(data)
+            self._check_done()
+
+    def feed(self, data):
+        if not self.done:
+            super().feed(data)
+
+    def close(self):
+        if not self.done:
+            super().close()
+
+    def result(self):
+        """Return the formatted content extracted so far"""
+        # Flush elements that were still open when the input ended
+        if self._container_parts:
+            self._add_segment(self._container_parts, self._containers)
+        if self._block_parts:
+            self._add_segment(self._block_parts, self._blocks)
+        title = self._title
+        if title is None and self._title_parts is not None:
+            title = "".join(self._title_parts).strip()
+        segments = self._containers if self._containers else self._blocks
+        return format_content(title or "No title found", segments, self.max_length)
+
+def extract_content_stream(html, max_length=2000):
+    """Extract page text with the single-pass streaming parser"""
+    extractor = StreamingExtractor(max_length)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.result()
+
+def extract_content_bs4(html, max_length=2000):
+    """Extract page text with BeautifulSoup (the original implementation)"""
+    # Imported here so the default engine never loads bs4
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Remove unwanted elements
+    for element in soup(['script', 'style', 'nav', 'footer', 'iframe']):
+        element.decompose()
+
+    # Extract title
+    title = soup.title.string if soup.title else "No title found"
+
+    # Extract main content
+    main_content = []
+
+    # Try to find main content containers
+    content_elements = soup.find_all(['article', 'main', 'div'], class_=CONTAINER_CLASS)
+    if not content_elements:
+        content_elements = soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+
+    for element in content_elements:
+        text = clean_text(element.get_text())
+        if text and len(text) > MIN_SEGMENT_LENGTH:  # Only include substantial content
+            main_content.append(text)
+
+    return format_content(title, main_content, max_length)
+
+class SearchResultParser(_TreeParser):
+    """
+    Single-pass parser for DuckDuckGo HTML result pages. Produces the same
+    list of {title, snippet, url} dictionaries as web.extract_search_results.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.results: List[Dict[str, str]] = []
+        self._current: Optional[Dict[str, List[str]]] = None
+        self._capture: Dict[str, int] = {}
+
+    def open_element(self, tag, attrs):
+        classes = (attrs.get("class") or "").split()
+        if self._current is None:
+            if "result" in classes:
+                self._current = {"title": None, "snippet": None, "url": None, "href": None}
+                return "result"
+            return None
+
+        for field, css_class in (("title", "result__title"), ("snippet", "result__snippet"), ("url", "result__url")):
+            if css_class in classes and self._current[field] is None:
+                self._current[field] = []
+                self._capture[field] = self._capture.get(field, 0) + 1
+                return field
+        if tag == "a" and self._capture.get("title") and self._current["href"] is None and "href" in attrs:
+            self._current["href"] = attrs["href"]
+        return None
+
+    def close_element(self, marker):
+        if marker in ("title", "snippet", "url"):
+            self._capture[marker] -= 1
+        elif marker == "result":
+            current, self._current = self._current, None
+            self._capture = {}
+            self._add_result(current)
+
+    def _add_result(self, current):
+        if current["title"] is None:
+            return
+        title = clean_text("".join(current["title"]))
+        url = current["href"] or ""
+        if not url and current["url"] is not None:  # Fallback to displayed URL
+            url = clean_text("".join(current["url"]))
+        snippet = clean_text("".join(current["snippet"])) if current["snippet"] is not None else ""
+        if title and (snippet or url):
+            self.results.append({
+                "title": title,
+                "snippet": snippet,
+                "url": url
+            })
+
+    def handle_data(self, data):
+        if self._current is None:
+            return
+        for field, depth in self._capture.items():
+            if depth:
+                self._current[field].append(data)
+
+def parse_search_results(html) -> List[Dict[str, str]]:
+    """Extract search results from a DuckDuckGo HTML page in one pass"""
+    parser = SearchResultParser()
+    parser.feed(html)
+    parser.close()
+    return parser.results
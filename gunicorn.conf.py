@@ -0,0 +1,44 @@
+"""
+Production entry point:
+
+    gunicorn main:app
+
+Gunicorn reads this file from the working directory. Each worker process
+runs its own dispatcher and event loop; with more than one worker the
+processes share rate limits, webhook dedupe, per-sender locks and the search
+and summary caches through files (see SHARED_STATE in config.py). Use the
+SQLite memory backend with several workers.
+
+On SIGTERM a worker stops taking new turns and waits up to DRAIN_TIMEOUT
+seconds for queued and running ones before it exits.
+"""
+import os
+
+from config import WEB_WORKERS, WEB_THREADS, DRAIN_TIMEOUT, SHARED_STATE, MEMORY_BACKEND
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = WEB_WORKERS
+# Webhook requests only enqueue turns, a few threads per worker are plenty
+worker_class = "gthread"
+threads = WEB_THREADS
+# The master kills workers that have not exited after this long
+graceful_timeout = DRAIN_TIMEOUT + 10
+timeout = 60
+keepalive = 5
+# Every worker must start its own event loop and threads after the fork
+preload_app = False
+accesslog = "-"
+
+def on_starting(server):
+    if WEB_WORKERS > 1 and not SHARED_STATE:
+        server.log.warning("SHARED_STATE is off with several workers: rate limits and per-sender ordering are per process")
+    if WEB_WORKERS > 1 and MEMORY_BACKEND != "sqlite":
+        server.log.warning("The JSON memory backend rewrites one file per message, use MEMORY_BACKEND=sqlite with several workers")
+
+def post_worker_init(worker):
+    import main
+    main.start_prewarm()
+
+def worker_exit(server, worker):
+    import main
+    main.shutdown(DRAIN_TIMEOUT)
@@ -1,25 +1,170 @@
-from config import GROQ_API_KEY
-from groq import Groq
+import threading, time
+from typing import AsyncIterator, Optional
+from config import (GROQ_API_KEY, GROQ_BASE_URL, LARGE_MODEL, SMALL_MODEL, FALLBACK_MODELS,
+                    MODEL_ROUTING, MODEL_COOLDOWN, LLM_TIMEOUT)
+from aio import run_sync
+from deadline import remaining, timeout_for
+from router import ModelRouter, SYNTHESIZE
+from tracing import traced, count
+import metrics
 
-groq_client = Groq(api_key=GROQ_API_KEY)
+# The Groq SDK is slow to import, it is loaded with the client on first use
+_async_groq_client = None
+_client_lock = threading.Lock()
 
-def query_llm(messages, model="meta-llama/llama-4-maverick-17b-128e-instruct", temperature=0.7, max_tokens=1024, top_p=1) -> str:
+router = ModelRouter(LARGE_MODEL, SMALL_MODEL, FALLBACK_MODELS, routing=MODEL_ROUTING, cooldown=MODEL_COOLDOWN)
+metrics.register_gauge("models", router.stats)
+
+def get_groq_client():
+    """Return the shared AsyncGroq client, creating it on first use"""
+    global _async_groq_client
+    if _async_groq_client is None:
+        with _client_lock:
+            if _async_groq_client is None:
+                from groq import AsyncGroq
+                # Failed calls move on to the next model instead of being retried by the SDK
+                _async_groq_client = AsyncGroq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, max_retries=0)
+    return _async_groq_client
+
+def fallback_errors():
+    """Errors another model may not run into"""
+    import groq
+    return (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError)
+
+def _failure(e: Exception):
+    """Return the failure reason and the Retry-After delay, if any"""
+    import groq
+    if isinstance(e, groq.RateLimitError):
+        retry_after = e.response.headers.get("retry-after") if e.response is not None else None
+        try:
+            return "rate_limited", float(retry_after) if retry_after else None
+        except ValueError:
+            return "rate_limited", None
+    if isinstance(e, groq.APITimeoutError):
+        return "timeout", None
+    return "error", None
+
+def _models(model: Optional[str], kind: str, deadline: Optional[float]):
+    if model:
+        return [model]
+    return router.candidates(kind, remaining(deadline))
+
+def _record_usage(usage) -> None:
+    if usage is not None and getattr(usage, "completion_tokens", None):
+        metrics.observe("llm.completion_tokens", usage.completion_tokens)
+        count("completion_tokens", usage.completion_tokens)
+
+@traced("llm")
+async def query_llm_async(messages, model=None, temperature=0.7, max_tokens=1024, top_p=1,
+                          kind=SYNTHESIZE, deadline=None) -> str:
     """
     Query the LLM with the provided messages and parameters.
-    
+
     :param messages: List of message dictionaries with 'role' and 'content'.
-    :param model: The model to use for the query.
+    :param model: The model to use for the query, or None to let the router pick one.
     :param temperature: Sampling temperature for response generation.
     :param max_tokens: Maximum number of tokens in the response.
     :param top_p: Top-p sampling parameter.
-    :return: The content of the LLM's response.
+    :param kind: Turn type used for routing: 'select', 'synthesize' or 'summary'.
+    :param deadline: time.monotonic() value by which the call must finish.
+    :return: The content of the LLM's response, empty if no model could answer.
     """
-    chat_completion = groq_client.chat.completions.create(
-        messages=messages,
-        model=model,
-        temperature=temperature,
-        max_tokens=max_tokens,
-        top_p=top_p
-    )
-    
-    return (chat_completion.choices[0].message.content or "").strip()
\ No newline at end of file
+    for candidate in _models(model, kind, deadline):
+        timeout = timeout_for(LLM_TIMEOUT, deadline)
+        if timeout <= 0:
+            metrics.inc("llm.budget_exhausted")
+            print("LLM latency budget for this turn is used up")
+            break
+        started_at = time.monotonic()
+        try:
+            chat_completion = await get_groq_client().chat.completions.create(
+                messages=messages,
+                model=candidate,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                timeout=timeout
+            )
+        except fallback_errors() as e:
+            reason, retry_after = _failure(e)
+            router.record_failure(candidate, reason, retry_after)
+            print(f"LLM call to {candidate} failed ({reason}): {str(e)}")
+            continue
+        router.record_success(candidate, time.monotonic() - started_at)
+        _record_usage(chat_completion.usage)
+
+        return (chat_completion.choices[0].message.content or "").strip()
+    return ""
+
+def query_llm(messages, model=None, temperature=0.7, max_tokens=1024, top_p=1, kind=SYNTHESIZE) -> str:
+    """Synchronous wrapper around query_llm_async"""
+    return run_sync(query_llm_async(messages, model=model, temperature=temperature, max_tokens=max_tokens,
+                                    top_p=top_p, kind=kind))
+
+async def stream_llm_async(messages, model=None, temperature=0.7, max_tokens=1024, top_p=1,
+                           kind=SYNTHESIZE, deadline=None) -> AsyncIterator[str]:
+    """
+    Stream the LLM's response as it is generated.
+
+    Takes the same parameters as query_llm_async and yields text chunks.
+    A model that fails before its first chunk is replaced by the next one.
+    Stopping iteration early closes the stream, which stops generation.
+    """
+    for candidate in _models(model, kind, deadline):
+        timeout = timeout_for(LLM_TIMEOUT, deadline)
+        if timeout <= 0:
+            metrics.inc("llm.budget_exhausted")
+            print("LLM latency budget for this turn is used up")
+            return
+        started_at = time.monotonic()
+        try:
+            stream = await get_groq_client().chat.completions.create(
+                messages=messages,
+                model=candidate,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                stream=True,
+                timeout=timeout
+            )
+        except fallback_errors() as e:
+            reason, retry_after = _failure(e)
+            router.record_failure(candidate, reason, retry_after)
+            print(f"LLM call to {candidate} failed ({reason}): {str(e)}")
+            continue
+
+        first_token = True
+        # 'completed' when the stream ended, 'stopped' when the caller stopped
+        # reading; a cancelled stream (turn deadline, interrupt) records nothing
+        outcome = None
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        first_token = False
+                        metrics.observe("llm.first_token_seconds", time.monotonic() - started_at)
+                    yield chunk.choices[0].delta.content
+                # Groq reports usage on the last chunk
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None:
+                    _record_usage(getattr(x_groq, "usage", None))
+            outcome = "completed"
+        except fallback_errors() as e:
+            reason, retry_after = _failure(e)
+            router.record_failure(candidate, reason, retry_after)
+            print(f"LLM stream from {candidate} failed ({reason}): {str(e)}")
+            if not first_token:
+                # Part of the answer is out already, it cannot switch models
+                raise
+            continue
+        except GeneratorExit:
+            outcome = "stopped"
+            raise
+        finally:
+            if outcome == "completed":
+                router.record_success(candidate, time.monotonic() - started_at)
+            elif outcome == "stopped":
+                # The model answered, but a partial response time would skew its p95
+                router.record_success(candidate)
+            await stream.close()
+        return
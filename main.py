@@ -1,18 +1,78 @@
 import os
+import asyncio
+import hmac
+import threading
+import time
+from contextlib import aclosing
 from flask import Flask, request
-import requests
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
-from memory import get_chat_history, update_chat_memory, clear_chat_memory
-from web import web_search_tool
-from browser import browse_website
-from utils import parse_response
-from llm import query_llm
+from memory import get_chat_history, update_chat_memory, clear_chat_memory, flush_chat_memory, invalidate_chat_memory, get_store
+from web import web_search_tool_async, SEARCH_FAILURE_PREFIXES
+from browser import browse_website_async
+from utils import parse_response, StreamParser
+from llm import query_llm_async, stream_llm_async, get_groq_client, router
+from router import SELECT, SYNTHESIZE
+from aio import run_sync, submit as submit_coroutine, get_http_client
+from compaction import start_compaction_job
+from context import build_context, assemble, context_item, schedule_summary_refresh, clear_summary
+from dispatcher import Dispatcher, TurnCoalescer
+from ratelimit import RateLimiter, MessageDeduper
+from shared import SenderLocks, SharedStateDB, SharedRateLimiter, SharedMessageDeduper
+from sender import send_text, start_typing
+from answer_cache import AnswerCache, is_standalone
+from deadline import (TurnControl, TurnRegistry, DeadlineExceeded, TurnInterrupted, TurnCancelled, remaining,
+                      timeout_for)
+import metrics
+import tracing
 
-from config import VERIFY_TOKEN, PAGE_ACCESS_TOKEN
+from config import (VERIFY_TOKEN, WORKER_THREADS, MAX_PENDING_MESSAGES, MAX_PENDING_PER_SENDER,
+                    ASYNC_PIPELINE, MAX_IN_FLIGHT_TURNS, LLM_STREAMING,
+                    PARALLEL_TOOLS, MAX_PARALLEL_TOOLS, TOOL_CALL_TIMEOUT, TOOL_TOTAL_TIMEOUT,
+                    CONTEXT_TOKEN_BUDGET, DEDUP_TTL, SENDER_RATE_PER_MINUTE, SENDER_BURST,
+                    GLOBAL_RATE_PER_SECOND, GLOBAL_BURST, BUSY_REPLY_COOLDOWN,
+                    ANSWER_CACHE, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD,
+                    ANSWER_CACHE_MIN_WORDS, SHARED_STATE, SHARED_STATE_DB, LOCK_DIR, DRAIN_TIMEOUT,
+                    TURN_LATENCY_BUDGET, TURN_DEADLINE, TURN_DEADLINE_RESERVE, DEGRADED_ANSWER_CHARS,
+                    INTERRUPT_ON_NEW_MESSAGE, PREWARM, HTML_EXTRACTOR, SMALL_TALK_MAX_WORDS)
 
 app = Flask(__name__)
 
+RESET_COMMAND = "/reset"
+BUSY_MESSAGE = "I'm getting a lot of messages right now. Please try again in a minute."
+OUT_OF_TIME_MESSAGE = "Sorry, this is taking me too long. Could you try again, maybe with a simpler question?"
+# Results of tool calls that worked start with these, anything else is an error
+TOOL_RESULT_PREFIXES = ("Search results for ", "Content from ")
+
+coalescer = TurnCoalescer()
+running_turns = TurnRegistry()
+# Turns hold their sender's lock, so compaction in any process leaves them alone
+sender_locks = SenderLocks(LOCK_DIR)
+if SHARED_STATE:
+    # Several worker processes serve the webhook, coordinate through files
+    shared_db = SharedStateDB(SHARED_STATE_DB)
+    deduper = SharedMessageDeduper(shared_db, ttl=DEDUP_TTL)
+    rate_limiter = SharedRateLimiter(
+        shared_db,
+        sender_rate=SENDER_RATE_PER_MINUTE / 60.0,
+        sender_burst=SENDER_BURST,
+        global_rate=GLOBAL_RATE_PER_SECOND,
+        global_burst=GLOBAL_BURST,
+        busy_cooldown=BUSY_REPLY_COOLDOWN,
+    )
+else:
+    deduper = MessageDeduper(ttl=DEDUP_TTL)
+    rate_limiter = RateLimiter(
+        sender_rate=SENDER_RATE_PER_MINUTE / 60.0,
+        sender_burst=SENDER_BURST,
+        global_rate=GLOBAL_RATE_PER_SECOND,
+        global_burst=GLOBAL_BURST,
+        busy_cooldown=BUSY_REPLY_COOLDOWN,
+    )
+answer_cache = AnswerCache(max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_THRESHOLD)
+if ANSWER_CACHE:
+    metrics.register_gauge("answer_cache", answer_cache.stats)
+
 system_prompt = """You are a helpful AI assistant in a Facebook Messenger conversation. You have access to powerful tools to find accurate information.
 
 Available Tools:
@@ -61,33 +121,43 @@ MAKE SURE:
 - Responses are clear and concise
 """
 
-def send_message(recipient_id: str, text: str) -> None:
-    """Send message to Facebook user"""
+if PARALLEL_TOOLS:
+    # Independent lookups can be requested together and run concurrently
+    system_prompt = (system_prompt
+        .replace("2. ONE TOOL AT A TIME - Never use multiple tools in one response",
+                 "2. Use several tools in one response only for independent lookups (e.g. a multi-part question)")
+        .replace("- Don't use multiple tools at once\n", ""))
+
+@tracing.traced("send")
+async def send_message_async(recipient_id: str, text: str, deadline: Optional[float] = None) -> None:
+    """
+    Send message to Facebook user
+
+    :param deadline: time.monotonic() value after which sending is given up
+    """
     if not text or not text.strip():
         print(f"Warning: Attempted to send empty message to {recipient_id}")
         return
-        
+
     try:
         clean_text = text.strip()
-        
-        if not clean_text:
-            return
-            
-        url = 'https://graph.facebook.com/v18.0/me/messages'
-        params = {'access_token': PAGE_ACCESS_TOKEN}
-        payload = {
-            'recipient': {'id': recipient_id},
-            'message': {'text': clean_text[:2000]}
-        }
-        response = requests.post(url, params=params, json=payload)
-        response.raise_for_status()
-        print(f"Sent to {recipient_id}: {clean_text[:100]}...")
-        
+        # Long replies are split into several messages instead of being cut off
+        if await send_text(recipient_id, clean_text, deadline):
+            print(f"Sent to {recipient_id}: {clean_text[:100]}...")
+
     except Exception as e:
         print(f"Error sending message to {recipient_id}: {str(e)}")
 
-def execute_tool_call(tool_call: Dict[str, str]) -> Optional[str]:
-    """Execute a single tool call and return the result"""
+def send_message(recipient_id: str, text: str) -> None:
+    """Synchronous wrapper around send_message_async"""
+    run_sync(send_message_async(recipient_id, text))
+
+async def execute_tool_call_async(tool_call: Dict[str, str], deadline: Optional[float] = None) -> Optional[str]:
+    """
+    Execute a single tool call and return the result
+
+    :param deadline: time.monotonic() value by which the tool must finish
+    """
     try:
         if tool_call["tool"] == "web_search":
             query = tool_call.get("query", "").strip()
@@ -95,11 +165,13 @@ def execute_tool_call(tool_call: Dict[str, str]) -> Optional[str]:
                 return "Error: Search query was empty."
                 
             print(f"Executing web search: {query}")
-            result = web_search_tool(query)
-            if result:
-                return f"Search results for '{query}':\n{result}"
-            else:
+            with tracing.span("tool.web_search"):
+                result = await web_search_tool_async(query, deadline)
+            if not result:
                 return f"No search results found for '{query}'"
+            if result.startswith(SEARCH_FAILURE_PREFIXES):
+                return result
+            return f"Search results for '{query}':\n{result}"
                 
         elif tool_call["tool"] == "browse_url":
             url = tool_call.get("url", "").strip()
@@ -107,7 +179,8 @@ def execute_tool_call(tool_call: Dict[str, str]) -> Optional[str]:
                 return "Error: No URL provided."
                 
             print(f"Browsing website: {url}")
-            success, content = browse_website(url)
+            with tracing.span("tool.browse_url"):
+                success, content = await browse_website_async(url, deadline=deadline)
             if success and content:
                 return f"Content from {url}:\n{content}"
             else:
@@ -119,84 +192,275 @@ def execute_tool_call(tool_call: Dict[str, str]) -> Optional[str]:
     
     return None
 
-def process_message(sender_id: str, user_message: str) -> None:
+def execute_tool_call(tool_call: Dict[str, str]) -> Optional[str]:
+    """Synchronous wrapper around execute_tool_call_async"""
+    return run_sync(execute_tool_call_async(tool_call))
+
+async def run_tool_call_async(tool_call: Dict[str, str], deadline: Optional[float] = None) -> Optional[str]:
+    """Execute a tool call, limited to TOOL_CALL_TIMEOUT seconds or what is left before the deadline"""
+    timeout = timeout_for(TOOL_CALL_TIMEOUT, deadline)
+    try:
+        return await asyncio.wait_for(execute_tool_call_async(tool_call, deadline), timeout)
+    except asyncio.TimeoutError:
+        metrics.inc("tools.timeouts")
+        return f"Error: {tool_call['tool']} timed out after {timeout:.0f} seconds"
+
+async def execute_tool_calls_async(tool_calls: List[Dict[str, str]],
+                                   deadline: Optional[float] = None) -> List[Tuple[Dict[str, str], Optional[str]]]:
+    """
+    Execute several tool calls concurrently
+
+    Each call is limited to TOOL_CALL_TIMEOUT seconds and all of them together
+    to TOOL_TOTAL_TIMEOUT, or less if the deadline comes first. Duplicate
+    calls are only executed once.
+
+    :return: (tool_call, result) pairs in the order the calls were requested
+    """
+    unique_calls = []
+    for tool_call in tool_calls:
+        if tool_call not in unique_calls:
+            unique_calls.append(tool_call)
+
+    tasks = [asyncio.ensure_future(run_tool_call_async(tool_call, deadline)) for tool_call in unique_calls]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=timeout_for(TOOL_TOTAL_TIMEOUT, deadline))
+    finally:
+        # Also reached when the turn cancels this coroutine on its deadline or an interrupt
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+    results = []
+    for tool_call, task in zip(unique_calls, tasks):
+        if task in done:
+            results.append((tool_call, task.result()))
+        else:
+            results.append((tool_call, f"Error: {tool_call['tool']} did not finish in time"))
+    return results
+
+async def stream_response_async(sender_id: str, messages: List[Dict[str, str]],
+                                last_progress_message: Optional[str],
+                                stop_at_tool: bool = True, kind: str = SYNTHESIZE,
+                                deadline: Optional[float] = None) -> Tuple[str, Optional[str]]:
+    """
+    Stream an LLM response, sending the progress message as soon as its tag
+    is closed and, if stop_at_tool is set, stopping generation once a tool
+    call is complete
+
+    :return: The response text and the last progress message sent
+    """
+    parser = StreamParser()
+    said = False
+    async with aclosing(stream_llm_async(messages, kind=kind, deadline=deadline)) as stream:
+        async for chunk in stream:
+            for event, value in parser.feed(chunk):
+                # Like parse_response, only the first progress message counts
+                if event == "say" and not said:
+                    said = True
+                    if value and value != last_progress_message:
+                        last_progress_message = value
+                        await send_message_async(sender_id, value, deadline)
+                        await asyncio.to_thread(update_chat_memory, sender_id, "assistant", value)
+                elif event == "tool" and stop_at_tool:
+                    # Only the first tool call is executed, the rest is not needed
+                    return parser.text.strip(), last_progress_message
+    return parser.text.strip(), last_progress_message
+
+def tool_succeeded(result: Optional[str]) -> bool:
+    """Whether a tool result carries information rather than an error or an empty search"""
+    return bool(result) and result.startswith(TOOL_RESULT_PREFIXES)
+
+def with_sources(answer: str, sources: List[str]) -> str:
+    """A cached answer followed by the sources it was based on"""
+    if not sources:
+        return answer
+    return answer + "\n\nSources:\n" + "\n".join(f"- {source}" for source in sources)
+
+def degraded_answer(last_good_result: Optional[str]) -> str:
+    """The reply for a turn that ran out of time: what the last successful tool call found, if anything"""
+    if not last_good_result:
+        return OUT_OF_TIME_MESSAGE
+    found = last_good_result
+    if len(found) > DEGRADED_ANSWER_CHARS:
+        found = found[:DEGRADED_ANSWER_CHARS].rstrip() + "..."
+    return f"I ran out of time before I could finish, but here is what I found so far:\n\n{found}"
+
+async def process_message_async(sender_id: str, user_message: str) -> None:
     """Process user message with iterative responses"""
+    trace = tracing.start_trace(sender_id)
+    profiler = tracing.maybe_start_profiler(sender_id)
+    control = TurnControl(time.monotonic() + TURN_DEADLINE)
+    running_turns.register(sender_id, control)
+    typing_task = None
+    sender_lock = None
+    last_tool_result = None
+    # Only results that are worth showing if the turn runs out of time
+    last_good_result = None
     try:
+        # Another worker process or compaction may be working on this sender,
+        # wait for it
+        with tracing.span("sender_lock"):
+            sender_lock = await sender_locks.acquire(sender_id)
+        if SHARED_STATE:
+            # Read the history the other worker wrote
+            await asyncio.to_thread(invalidate_chat_memory, sender_id)
+        # Waiting for the lock is not this turn's time
+        control.deadline = time.monotonic() + TURN_DEADLINE
+        # Every step of the turn must finish before work_deadline, the rest of
+        # the deadline is kept for the reply
+        work_deadline = control.deadline - TURN_DEADLINE_RESERVE
+
         print(f"Processing message from {sender_id}: {user_message}")
         
-        if user_message == "/reset":
-            clear_chat_memory(sender_id)
-            send_message(sender_id, "Chat memory has been reset.")
+        if user_message == RESET_COMMAND:
+            await asyncio.to_thread(clear_chat_memory, sender_id)
+            await asyncio.to_thread(clear_summary, sender_id)
+            await send_message_async(sender_id, "Chat memory has been reset.")
             return
 
+        typing_task = start_typing(sender_id)
+
+        # Messages that arrived while this turn was queued are answered together
+        extra_messages = coalescer.take(sender_id)
+        if extra_messages:
+            user_message = "\n".join([user_message] + extra_messages)
+
         # Get chat history
-        chat_history = get_chat_history(sender_id)
-        
-        # Build conversation context
-        messages = [{"role": "system", "content": system_prompt}]
-        
-        # Add recent chat history including tool results for better context
-        recent_history = chat_history[-8:] if chat_history else []
-        for msg in recent_history:
-            if msg.get("content") and msg.get("role") in ["user", "assistant"]:
-                # Don't include progress messages in context
-                if msg.get("type") != "message" or "Let me" not in msg["content"]:
-                    messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"]
-                    })
-        
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
+        chat_history = await asyncio.to_thread(get_chat_history, sender_id)
+
+        # Answers depend on the chat before them, only a single question
+        # that opens a conversation and stands on its own can be shared
+        cacheable = (ANSWER_CACHE and not extra_messages and not chat_history and
+                     len(user_message.split()) >= ANSWER_CACHE_MIN_WORDS and is_standalone(user_message))
+        if cacheable:
+            cached = answer_cache.lookup(user_message)
+            if cached:
+                entry, similarity = cached
+                print(f"Answer cache hit for {sender_id} ({similarity:.2f}): {entry['question']} sources={entry['sources']}")
+                answer = with_sources(entry["answer"], entry["sources"])
+                await asyncio.to_thread(update_chat_memory, sender_id, "user", user_message)
+                await send_message_async(sender_id, answer, control.deadline)
+                await asyncio.to_thread(update_chat_memory, sender_id, "assistant", answer)
+                return
+
+        # Build conversation context: system prompt, summary of older turns,
+        # recent chat history including tool results and the current message
+        context = await asyncio.to_thread(build_context, sender_id, system_prompt, chat_history, user_message)
         
         # Save user message to memory
-        update_chat_memory(sender_id, "user", user_message)
+        await asyncio.to_thread(update_chat_memory, sender_id, "user", user_message)
         
         # Start iterative conversation
+        llm_deadline = min(work_deadline, time.monotonic() + TURN_LATENCY_BUDGET)
         max_iterations = 8  # Prevent infinite loops
         iteration = 0
         last_progress_message = None
-        last_tool_result = None
         has_used_tool = False
+        # Set once the small model answered more than small talk itself
+        needs_large_model = False
+        sources = []
         
         while iteration < max_iterations:
             iteration += 1
+            trace.iteration = iteration
             print(f"Iteration {iteration}")
+            control.check()
+
+            # Fold in messages the user sent while we were working; newer
+            # ones interrupt the next step again
+            control.reset()
+            for extra_message in coalescer.take(sender_id):
+                cacheable = False
+                context.append(context_item("user", extra_message, "user"))
+                await asyncio.to_thread(update_chat_memory, sender_id, "user", extra_message)
+
+            # Fit the context into the token budget
+            messages, prompt_tokens = assemble(context, CONTEXT_TOKEN_BUDGET)
+            tracing.count("prompt_tokens", prompt_tokens)
+            metrics.observe("llm.prompt_tokens", prompt_tokens)
+            print(f"Prompt tokens: {prompt_tokens} (budget {CONTEXT_TOKEN_BUDGET})")
             
-            # Get AI response
-            ai_response = query_llm(messages)
+            # Get AI response; deciding on a tool is a job for the small model,
+            # answering for the large one
+            kind = SYNTHESIZE if has_used_tool or needs_large_model else SELECT
+            try:
+                if LLM_STREAMING:
+                    with tracing.span("llm"):
+                        ai_response, last_progress_message = await control.run(stream_response_async(
+                            sender_id, messages, last_progress_message, stop_at_tool=not PARALLEL_TOOLS,
+                            kind=kind, deadline=llm_deadline), work_deadline)
+                else:
+                    ai_response = await control.run(query_llm_async(messages, kind=kind, deadline=llm_deadline),
+                                                    work_deadline)
+            except TurnInterrupted:
+                # Start over with the new message, the interrupted step does not count
+                print(f"New message from {sender_id}, restarting iteration {iteration}")
+                metrics.inc("turns.interrupted")
+                iteration -= 1
+                continue
             if not ai_response:
-                send_message(sender_id, "I'm having trouble responding right now. Could you try again?")
+                if remaining(llm_deadline) <= 0:
+                    raise DeadlineExceeded()
+                await send_message_async(sender_id, "I'm having trouble responding right now. Could you try again?",
+                                         control.deadline)
                 return
             
             print(f"AI Response: {ai_response}")
             
             # Parse response for tools and say_in_middle
             parsed = parse_response(ai_response)
+
+            # The small model answered without a tool: fine for small talk,
+            # anything else is answered again by the large model
+            if (kind == SELECT and router.routing and parsed.get("task_finished") and not parsed.get("tools")
+                    and len(user_message.split()) > SMALL_TALK_MAX_WORDS):
+                print("Small model answered without a tool, asking the large model")
+                metrics.inc("llm.select_answers_redone")
+                needs_large_model = True
+                continue
             
             # Handle progress message (only if different from last one)
             if parsed.get("say_message") and parsed["say_message"] != last_progress_message:
                 last_progress_message = parsed["say_message"]
-                send_message(sender_id, parsed["say_message"])
-                update_chat_memory(sender_id, "assistant", parsed["say_message"])
+                await send_message_async(sender_id, parsed["say_message"], work_deadline)
+                await asyncio.to_thread(update_chat_memory, sender_id, "assistant", parsed["say_message"])
             
-            # Execute tool calls one at a time
+            # Execute tool calls, one at a time unless parallel tools are enabled
             if parsed.get("tools"):
                 has_used_tool = True
-                tool_call = parsed["tools"][0]  # Take only the first tool call
-                tool_result = execute_tool_call(tool_call)
-                
-                if tool_result:
-                    print(f"Tool result: {tool_result[:200]}...")
-                    last_tool_result = tool_result
-                    # Add tool result to conversation context
-                    messages.append({"role": "assistant", "content": tool_result})
-                    # Save tool result to memory
-                    update_chat_memory(sender_id, "assistant", tool_result, tool_info={
-                        "tool": tool_call["tool"],
-                        "query": tool_call.get("query", tool_call.get("url", ""))
-                    })
-                    # Continue loop to process the tool result
+                try:
+                    if PARALLEL_TOOLS:
+                        tool_results = await control.run(
+                            execute_tool_calls_async(parsed["tools"][:MAX_PARALLEL_TOOLS], work_deadline), work_deadline)
+                    else:
+                        tool_call = parsed["tools"][0]  # Take only the first tool call
+                        tool_results = [(tool_call, await control.run(run_tool_call_async(tool_call, work_deadline),
+                                                                      work_deadline))]
+                except TurnInterrupted:
+                    print(f"New message from {sender_id}, restarting iteration {iteration}")
+                    metrics.inc("turns.interrupted")
+                    iteration -= 1
+                    continue
+
+                got_result = False
+                for tool_call, tool_result in tool_results:
+                    if tool_result:
+                        print(f"Tool result: {tool_result[:200]}...")
+                        last_tool_result = tool_result
+                        got_result = True
+                        if tool_succeeded(tool_result):
+                            last_good_result = tool_result
+                            sources.append(tool_call["url"] if tool_call["tool"] == "browse_url"
+                                           else f"web search: {tool_call.get('query', '')}")
+                        # Add tool result to conversation context
+                        context.append(context_item("assistant", tool_result, "tool"))
+                        # Save tool result to memory
+                        await asyncio.to_thread(update_chat_memory, sender_id, "assistant", tool_result, tool_info={
+                            "tool": tool_call["tool"],
+                            "query": tool_call.get("query", tool_call.get("url", ""))
+                        })
+                if got_result:
+                    # Continue loop to process the tool results
                     continue
             
             # If we have a final response and no pending tool results, send it
@@ -207,8 +471,11 @@ def process_message(sender_id: str, user_message: str) -> None:
                     if final_response != last_progress_message:
                         # If we've used a tool, make sure we have processed its results
                         if not (has_used_tool and not last_tool_result):
-                            send_message(sender_id, final_response)
-                            update_chat_memory(sender_id, "assistant", final_response)
+                            await send_message_async(sender_id, final_response, control.deadline)
+                            await asyncio.to_thread(update_chat_memory, sender_id, "assistant", final_response)
+                            # Only answers grounded in tool results are worth reusing
+                            if cacheable and sources:
+                                answer_cache.add(user_message, final_response, sources)
                             return
             
             # If we have a tool result but no final response yet, continue
@@ -222,17 +489,142 @@ def process_message(sender_id: str, user_message: str) -> None:
         # If we hit max iterations, send a wrap-up message
         print("Hit max iterations, wrapping up")
         wrap_up_msg = "I've gathered some information but let me wrap this up. How else can I help you?"
-        send_message(sender_id, wrap_up_msg)
-        update_chat_memory(sender_id, "assistant", wrap_up_msg)
-        
+        await send_message_async(sender_id, wrap_up_msg, control.deadline)
+        await asyncio.to_thread(update_chat_memory, sender_id, "assistant", wrap_up_msg)
+
+    except TurnCancelled:
+        print(f"Turn for {sender_id} was cancelled")
+        metrics.inc("turns.cancelled")
+
+    except DeadlineExceeded:
+        # Answer with the best we have instead of letting the user wait longer
+        print(f"Turn for {sender_id} ran out of time after {TURN_DEADLINE - control.remaining():.1f}s")
+        metrics.inc("turns.deadline_exceeded")
+        tracing.count("deadline_exceeded")
+        answer = degraded_answer(last_good_result)
+        await send_message_async(sender_id, answer, control.deadline)
+        await asyncio.to_thread(update_chat_memory, sender_id, "assistant", answer)
+
     except Exception as e:
         print(f"Error in process_message: {str(e)}")
         error_msg = "I'm sorry, I encountered an error. Could you try asking that again?"
-        send_message(sender_id, error_msg)
+        await send_message_async(sender_id, error_msg, control.deadline)
         try:
-            update_chat_memory(sender_id, "assistant", error_msg)
+            await asyncio.to_thread(update_chat_memory, sender_id, "assistant", error_msg)
         except:
             pass
+    finally:
+        running_turns.unregister(sender_id, control)
+        if typing_task is not None:
+            typing_task.cancel()
+        # Write everything this turn added to memory in one go
+        await asyncio.to_thread(flush_chat_memory, sender_id)
+        if sender_lock is not None:
+            sender_locks.release(sender_lock)
+        if profiler is not None:
+            await asyncio.to_thread(tracing.save_profile, sender_id, profiler)
+        tracing.finish_trace(trace)
+        # The summary's LLM call counts against the global rate limit
+        schedule_summary_refresh(sender_id, rate_limiter.allow_global)
+        # Messages that arrived after the last iteration get a turn of their
+        # own, queued before any newer message can start one; they were
+        # accepted when they arrived, so the rate limit is not charged again.
+        # A command never opened the coalescer, there is nothing to close.
+        if user_message != RESET_COMMAND and not coalescer.hand_over(
+                sender_id, lambda text: dispatcher.submit(sender_id, text)):
+            print(f"Dropping messages from {sender_id}: queue is full")
+            send_busy_reply(sender_id)
+
+def process_message(sender_id: str, user_message: str) -> None:
+    """Synchronous wrapper around process_message_async"""
+    run_sync(process_message_async(sender_id, user_message))
+
+# In async mode turns run as coroutines on the shared event loop, so many
+# more of them can be in flight than there would be worker threads
+dispatcher = Dispatcher(
+    process_message_async if ASYNC_PIPELINE else process_message,
+    workers=MAX_IN_FLIGHT_TURNS if ASYNC_PIPELINE else WORKER_THREADS,
+    max_pending=MAX_PENDING_MESSAGES,
+    max_pending_per_sender=MAX_PENDING_PER_SENDER,
+)
+
+# Trim, archive and expire old chat memory in the background if COMPACTION_INTERVAL is set
+start_compaction_job()
+
+def send_busy_reply(sender_id: str) -> None:
+    """Tell the sender we are overloaded, at most once per BUSY_REPLY_COOLDOWN"""
+    metrics.inc("turns.rejected")
+    if rate_limiter.should_notify_busy(sender_id):
+        submit_coroutine(send_message_async(sender_id, BUSY_MESSAGE))
+
+def start_turn(sender_id: str, text: str) -> bool:
+    """
+    Queue a new turn for the sender, subject to the rate limits
+
+    :return: False if the turn was rejected and a busy reply was sent instead
+    """
+    if not rate_limiter.allow(sender_id):
+        print(f"Rate limited {sender_id}")
+        send_busy_reply(sender_id)
+        return False
+    coalescer.open(sender_id)
+    if not dispatcher.submit(sender_id, text):
+        print(f"Dropping message from {sender_id}: queue is full")
+        coalescer.close(sender_id)
+        send_busy_reply(sender_id)
+        return False
+    return True
+
+def start_reset(sender_id: str) -> None:
+    """
+    Handle /reset: drop the messages waiting for the sender's open turn,
+    cancel the turn if it is running and queue the reset behind it, so the
+    memory is cleared after that turn has written its last entries
+    """
+    coalescer.take(sender_id)
+    running_turns.cancel(sender_id)
+    if not dispatcher.submit(sender_id, RESET_COMMAND):
+        print(f"Dropping reset from {sender_id}: queue is full")
+        send_busy_reply(sender_id)
+
+def shutdown(timeout: float = DRAIN_TIMEOUT) -> bool:
+    """
+    Stop accepting turns, wait for queued and running ones to finish and
+    write the remaining chat memory. Called when a worker process exits.
+
+    :return: True if every turn finished before the timeout
+    """
+    print(f"Draining turns (up to {timeout}s)...")
+    drained = dispatcher.shutdown(timeout)
+    if not drained:
+        print(f"Shutdown timed out with {dispatcher.stats()['in_flight']} turns in flight")
+    flush_chat_memory()
+    return drained
+
+async def _prewarm_loop() -> None:
+    # The pooled HTTP client belongs to the event loop, create it there
+    get_http_client()
+
+def prewarm() -> None:
+    """Import the heavy dependencies and build the clients the first turn needs"""
+    started_at = time.monotonic()
+    try:
+        get_groq_client()
+        run_sync(_prewarm_loop())
+        get_store()
+        if HTML_EXTRACTOR == "bs4":
+            import bs4
+    except Exception as e:
+        print(f"Prewarm failed: {str(e)}")
+        return
+    seconds = time.monotonic() - started_at
+    metrics.observe("startup.prewarm_seconds", seconds)
+    print(f"Prewarmed in {seconds:.2f}s")
+
+def start_prewarm() -> None:
+    """Run prewarm() in a background thread if PREWARM is on; call once the server is listening"""
+    if PREWARM:
+        threading.Thread(target=prewarm, name="prewarm", daemon=True).start()
 
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
@@ -263,9 +655,27 @@ def webhook():
                             
                             if not text:
                                 continue
+
+                            # Messenger retries webhooks, skip messages we already have
+                            mid = message.get('mid')
+                            if mid and deduper.seen(mid):
+                                metrics.inc("webhook.duplicates")
+                                continue
                             
                             print(f"Received message from {sender_id}: {text}")
-                            process_message(sender_id, text)
+                            # Commands are handled on their own, never folded into a turn
+                            if text == RESET_COMMAND:
+                                start_reset(sender_id)
+                                continue
+                            # A turn for this sender is already queued or running
+                            if coalescer.add(sender_id, text):
+                                metrics.inc("webhook.coalesced")
+                                if INTERRUPT_ON_NEW_MESSAGE:
+                                    # Stop the running step, the turn continues with this message
+                                    running_turns.interrupt(sender_id)
+                                continue
+                            # Acknowledge right away, the reply is sent from a worker
+                            start_turn(sender_id, text)
                             
             return "ok", 200
             
@@ -278,7 +688,33 @@ def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "message": "Bot is running"}, 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Queue depth, latency and counter metrics"""
+    return {
+        "dispatcher": dispatcher.stats(),
+        "coalescer": coalescer.stats(),
+        "deduper": deduper.stats(),
+        **metrics.snapshot()
+    }, 200
+
+@app.route('/profile', methods=['GET', 'POST'])
+def profile_endpoint():
+    """
+    Show or switch the sender whose turns are profiled. Requires the verify
+    token in the X-Profile-Token header, never in the URL, which ends up in
+    access logs; disabled when no verify token is configured.
+    """
+    token = request.headers.get("X-Profile-Token") or ""
+    if not VERIFY_TOKEN or not hmac.compare_digest(token.encode("utf-8"), VERIFY_TOKEN.encode("utf-8")):
+        return "Unauthorized", 403
+    if request.method == 'POST':
+        tracing.set_profiled_sender(request.args.get("sender", ""))
+    return {"profiled_sender": tracing.get_profiled_sender()}, 200
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     print(f"Starting bot on port {port}")
+    # Runs while the server starts listening, requests never wait for it
+    start_prewarm()
     app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
@@ -1,108 +1,257 @@
-import os, json
+import atexit, threading, time
+from collections import OrderedDict, deque
+from itertools import islice
 from datetime import datetime
-from typing import List, Dict, Any
-from config import MEMORY_FILE, MAX_MEMORY
+from typing import List, Dict, Any, Optional
+from config import (MEMORY_BACKEND, MEMORY_FILE, MEMORY_DB, MAX_MEMORY,
+                    MEMORY_CACHE_SIZE, MEMORY_CACHE_TTL, MEMORY_FLUSH_INTERVAL,
+                    MEMORY_ARCHIVE_DB, MEMORY_ARCHIVE_AFTER_DAYS)
+from storage import MemoryStore, ArchiveStore, create_store
+from migrate_memory import import_legacy_memory
+from tracing import traced
+import metrics
 
-def load_memory() -> Dict[str, List[Dict[str, Any]]]:
-    """Load chat memory from file"""
-    if os.path.exists(MEMORY_FILE):
+_store = None
+_archive = None
+_store_lock = threading.Lock()
+
+def get_store() -> MemoryStore:
+    """Return the configured memory store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                path = MEMORY_DB if MEMORY_BACKEND == "sqlite" else MEMORY_FILE
+                store = create_store(MEMORY_BACKEND, path)
+                if MEMORY_BACKEND == "sqlite":
+                    # Histories from before the switch to SQLite
+                    try:
+                        import_legacy_memory(store, MEMORY_FILE)
+                    except Exception as e:
+                        print(f"Error importing {MEMORY_FILE}, run migrate_memory.py: {str(e)}")
+                _store = store
+    return _store
+
+def get_archive() -> Optional[ArchiveStore]:
+    """Return the archive of cold conversations, or None if archiving is off"""
+    global _archive
+    if _archive is None and MEMORY_ARCHIVE_AFTER_DAYS > 0:
+        with _store_lock:
+            if _archive is None:
+                _archive = ArchiveStore(MEMORY_ARCHIVE_DB)
+    return _archive
+
+def _load(sender_id: str) -> List[Dict[str, Any]]:
+    """Load a sender's history, bringing it back from the archive if it was archived"""
+    entries = get_store().load(sender_id)
+    archive = get_archive()
+    if entries or archive is None:
+        return entries
+    archived = archive.get(sender_id)
+    if not archived:
+        return entries
+    get_store().replace(sender_id, archived[-MAX_MEMORY:])
+    archive.delete(sender_id)
+    metrics.inc("memory.restored_from_archive")
+    return archived[-MAX_MEMORY:]
+
+class _CachedHistory:
+    """A sender's recent history plus the entries not yet written to the store"""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        # deque(maxlen) drops the oldest entry on append, so trimming is O(1)
+        self.entries = deque(entries, maxlen=MAX_MEMORY)
+        self.pending: List[Dict[str, Any]] = []
+        self.loaded_at = time.monotonic()
+        self.flush_lock = threading.Lock()
+
+_cache: "OrderedDict[str, _CachedHistory]" = OrderedDict()
+_cache_lock = threading.RLock()
+_flusher: Optional[threading.Thread] = None
+
+def _start_flusher() -> None:
+    global _flusher
+    if _flusher is not None or MEMORY_FLUSH_INTERVAL <= 0:
+        return
+
+    def run():
+        while True:
+            time.sleep(MEMORY_FLUSH_INTERVAL)
+            flush_chat_memory()
+
+    _flusher = threading.Thread(target=run, name="memory-flusher", daemon=True)
+    _flusher.start()
+
+def _flush_cached(sender_id: str, cached: _CachedHistory) -> None:
+    with cached.flush_lock:
+        with _cache_lock:
+            batch, cached.pending = cached.pending, []
+        if not batch:
+            return
         try:
-            with open(MEMORY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError as e:
-            print(f"Error loading memory file: {str(e)}")
-            return {}
-    return {}
-
-def save_memory(memory: Dict[str, List[Dict[str, Any]]]) -> None:
-    """Save chat memory to file"""
-    try:
-        with open(MEMORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(memory, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print(f"Error saving memory: {str(e)}")
+            get_store().append(sender_id, batch, MAX_MEMORY)
+        except Exception:
+            with _cache_lock:
+                cached.pending = (batch + cached.pending)[-MAX_MEMORY:]
+            raise
+
+def _is_written(cached: _CachedHistory) -> bool:
+    """
+    Whether everything in a cached history is in the store, so it can be
+    dropped; caller holds _cache_lock. A flush holds flush_lock from taking
+    the pending entries until they are written.
+    """
+    return not cached.pending and not cached.flush_lock.locked()
+
+def _get_cached(sender_id: str) -> _CachedHistory:
+    with _cache_lock:
+        cached = _cache.get(sender_id)
+        if cached is not None:
+            expired = time.monotonic() - cached.loaded_at > MEMORY_CACHE_TTL
+            if not expired or not _is_written(cached):
+                _cache.move_to_end(sender_id)
+                return cached
+            del _cache[sender_id]
+
+    cached = _CachedHistory(_load(sender_id))
+
+    with _cache_lock:
+        # Another thread may have loaded the same sender meanwhile
+        existing = _cache.get(sender_id)
+        if existing is not None:
+            _cache.move_to_end(sender_id)
+            return existing
+        _cache[sender_id] = cached
+        excess = len(_cache) - MEMORY_CACHE_SIZE
+        if excess > 0:
+            # Histories not written yet stay until a flush, a load of the
+            # same sender would miss their entries
+            written = (key for key, history in _cache.items() if key != sender_id and _is_written(history))
+            for evicted_id in list(islice(written, excess)):
+                del _cache[evicted_id]
+        _start_flusher()
+    return cached
+
+@traced("memory.flush")
+def flush_chat_memory(sender_id: str = None) -> None:
+    """
+    Write buffered entries to the store in a single write per sender
+
+    :param sender_id: Only flush this sender, or every cached sender if None
+    """
+    with _cache_lock:
+        if sender_id is not None:
+            targets = [(sender_id, _cache[sender_id])] if sender_id in _cache else []
+        else:
+            targets = list(_cache.items())
+
+    for target_id, cached in targets:
+        try:
+            _flush_cached(target_id, cached)
+        except Exception as e:
+            print(f"Error flushing chat memory for {target_id}: {str(e)}")
+
+atexit.register(flush_chat_memory)
+
+def invalidate_chat_memory(sender_id: str) -> None:
+    """
+    Flush and drop a sender's cached history so the next read comes from the
+    store; needed when other processes may have written to it
+    """
+    flush_chat_memory(sender_id)
+    with _cache_lock:
+        cached = _cache.get(sender_id)
+        if cached is not None and _is_written(cached):
+            del _cache[sender_id]
 
+def cache_stats() -> Dict[str, Any]:
+    """Size of the in-process history cache"""
+    with _cache_lock:
+        histories = list(_cache.values())
+    entries = sum(len(cached.entries) for cached in histories)
+    return {
+        "senders": len(histories),
+        "entries": entries,
+        "pending": sum(len(cached.pending) for cached in histories),
+        "content_bytes": sum(len(entry.get("content", "")) for cached in histories for entry in list(cached.entries)),
+    }
+
+metrics.register_gauge("memory_cache", cache_stats)
+
+@traced("memory.update")
 def update_chat_memory(sender_id: str, role: str, content: str, tool_info: Dict = None) -> None:
     """
     Update chat memory for a specific sender
-    
+
     :param sender_id: The unique identifier for the sender
     :param role: One of 'user' or 'assistant'
     :param content: The message content
     :param tool_info: Optional dictionary containing tool call information
     """
     try:
-        memory = load_memory()
-        if sender_id not in memory:
-            memory[sender_id] = []
-        
         # Add new message
         entry = {
             "role": role,
             "content": content,
             "timestamp": datetime.now().isoformat()
         }
-        
+
         # Add tool information if provided
         if tool_info:
             entry["tool_info"] = tool_info
             entry["type"] = "tool_output"
         else:
             entry["type"] = "message"
-        
-        memory[sender_id].append(entry)
-        
-        # Keep only last MAX_MEMORY messages, but ensure we keep tool context pairs together
-        if len(memory[sender_id]) > MAX_MEMORY:
-            # Keep tool outputs with their corresponding messages
-            filtered_memory = []
-            tool_context = []
-            
-            for msg in memory[sender_id][-MAX_MEMORY*2:]:  # Look at more messages to ensure context
-                if msg["role"] == "tool":
-                    tool_context.append(msg)
-                else:
-                    if tool_context:  # Add accumulated tool context before the message
-                        filtered_memory.extend(tool_context)
-                        tool_context = []
-                    filtered_memory.append(msg)
-            
-            # Add any remaining tool context
-            if tool_context:
-                filtered_memory.extend(tool_context)
-                
-            # Trim to MAX_MEMORY while keeping tool contexts
-            memory[sender_id] = filtered_memory[-MAX_MEMORY:]
-        
-        save_memory(memory)
+
+        if MEMORY_CACHE_SIZE <= 0:
+            get_store().append(sender_id, [entry], MAX_MEMORY)
+            return
+
+        # Buffered until flush_chat_memory, only the last MAX_MEMORY messages are kept
+        cached = _get_cached(sender_id)
+        with _cache_lock:
+            cached.entries.append(entry)
+            cached.pending.append(entry)
+            if len(cached.pending) > MAX_MEMORY:
+                del cached.pending[:-MAX_MEMORY]
     except Exception as e:
         print(f"Error updating chat memory: {str(e)}")
 
+@traced("memory.get_history")
 def get_chat_history(sender_id: str) -> List[Dict[str, Any]]:
     """
     Get chat history for a specific sender
-    
+
     :param sender_id: The unique identifier for the sender
     :return: List of chat messages with role and content
     """
     try:
-        memory = load_memory()
-        return memory.get(sender_id, [])
+        if MEMORY_CACHE_SIZE <= 0:
+            return _load(sender_id)
+        cached = _get_cached(sender_id)
+        with _cache_lock:
+            return list(cached.entries)
     except Exception as e:
         print(f"Error getting chat history: {str(e)}")
         return []
-    
+
+@traced("memory.clear")
 def clear_chat_memory(sender_id: str) -> None:
     """
     Clear chat memory for a specific sender
-    
+
     :param sender_id: The unique identifier for the sender
     """
     try:
-        memory = load_memory()
-        if sender_id in memory:
-            print(f"Clearing chat memory for {sender_id}")
-            del memory[sender_id]
-            save_memory(memory)
+        print(f"Clearing chat memory for {sender_id}")
+        with _cache_lock:
+            cached = _cache.pop(sender_id, None)
+        if cached is not None:
+            with cached.flush_lock:
+                cached.pending = []
+        get_store().delete(sender_id)
+        archive = get_archive()
+        if archive is not None:
+            archive.delete(sender_id)
     except Exception as e:
-        print(f"Error clearing chat memory: {str(e)}")
\ No newline at end of file
+        print(f"Error clearing chat memory: {str(e)}")
@@ -0,0 +1,77 @@
+import threading
+from collections import deque
+from typing import Any, Callable, Dict
+
+HISTOGRAM_WINDOW = 2048
+
+class Histogram:
+    """Keeps a sliding window of observations and reports percentiles over it"""
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self._values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self._values.append(value)
+        self.count += 1
+        self.total += value
+
+    def percentile(self, pct: float) -> float:
+        if not self._values:
+            return 0.0
+        ordered = sorted(self._values)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "p50": round(self.percentile(50), 4),
+            "p95": round(self.percentile(95), 4),
+            "p99": round(self.percentile(99), 4),
+        }
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_histograms: Dict[str, Histogram] = {}
+_gauges: Dict[str, Callable[[], Any]] = {}
+
+def inc(name: str, amount: float = 1) -> None:
+    """Increment a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def observe(name: str, value: float) -> None:
+    """Record a value (usually a latency in seconds) in a histogram"""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(value)
+
+def register_gauge(name: str, func: Callable[[], Any]) -> None:
+    """Register a callable that is evaluated every time a snapshot is taken"""
+    with _lock:
+        _gauges[name] = func
+
+def snapshot() -> Dict[str, Any]:
+    """Return the current value of every counter, gauge and histogram"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {name: h.summary() for name, h in _histograms.items()}
+        gauges = dict(_gauges)
+
+    gauge_values = {}
+    for name, func in gauges.items():
+        try:
+            gauge_values[name] = func()
+        except Exception as e:
+            gauge_values[name] = f"error: {str(e)}"
+
+    return {
+        "counters": counters,
+        "gauges": gauge_values,
+        "histograms": histograms,
+    }
@@ -0,0 +1,82 @@
+"""
+Import an existing chat_memory.json file into the configured memory store.
+
+Usage:
+    python migrate_memory.py [--source chat_memory.json] [--backend sqlite] [--target chat_memory.db]
+
+The bot also does this by itself on the first start with the SQLite backend
+when the database is still empty (see import_legacy_memory).
+"""
+import argparse, json, os, sys
+
+from config import MEMORY_BACKEND, MEMORY_FILE, MEMORY_DB
+from shared import file_lock
+from storage import MemoryStore, create_store
+
+MIGRATED_SUFFIX = ".migrated"
+
+def _copy(memory: dict, store: MemoryStore) -> None:
+    for sender_id, entries in memory.items():
+        store.replace(sender_id, entries)
+
+def import_legacy_memory(store: MemoryStore, source: str = MEMORY_FILE) -> int:
+    """
+    Import the legacy JSON memory file into a store that is still empty, so
+    histories survive the switch to SQLite. The file is renamed afterwards,
+    so a store that is emptied later is not filled from it again. Worker
+    processes starting together import it once.
+
+    :return: Number of senders imported
+    """
+    if not os.path.exists(source):
+        return 0
+    with file_lock(source):
+        # Another process may have imported it while we waited
+        if not os.path.exists(source) or store.senders():
+            return 0
+        with open(source, 'r', encoding='utf-8') as f:
+            memory = json.load(f)
+        _copy(memory, store)
+        os.replace(source, source + MIGRATED_SUFFIX)
+    print(f"Imported {len(memory)} senders from {source}, the file was renamed to {source + MIGRATED_SUFFIX}")
+    return len(memory)
+
+def migrate(source: str, backend: str, target: str) -> int:
+    """
+    Copy every sender from a legacy JSON memory file into a store
+
+    :param source: Path of the legacy JSON file
+    :param backend: Backend of the target store
+    :param target: Path of the target store
+    :return: Number of senders imported
+    """
+    with open(source, 'r', encoding='utf-8') as f:
+        memory = json.load(f)
+
+    store = create_store(backend, target)
+    try:
+        _copy(memory, store)
+    finally:
+        store.close()
+    return len(memory)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import chat_memory.json into the memory store")
+    parser.add_argument("--source", default=MEMORY_FILE, help="legacy JSON memory file")
+    parser.add_argument("--backend", default=MEMORY_BACKEND, choices=["sqlite", "json"])
+    parser.add_argument("--target", default=None, help="target database or file")
+    args = parser.parse_args()
+
+    target = args.target or (MEMORY_DB if args.backend == "sqlite" else MEMORY_FILE)
+    if not os.path.exists(args.source):
+        print(f"Source file not found: {args.source}")
+        sys.exit(1)
+    if os.path.abspath(target) == os.path.abspath(args.source):
+        print("Source and target are the same file, nothing to do")
+        sys.exit(1)
+
+    count = migrate(args.source, args.backend, target)
+    print(f"Imported {count} senders from {args.source} into {target}")
+
+if __name__ == '__main__':
+    main()
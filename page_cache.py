@@ -0,0 +1,178 @@
+import re, threading, time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|mc_cid|mc_eid)$', re.IGNORECASE)
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a URL so that trivially different spellings share a cache entry:
+    scheme and host are lower-cased, default ports, fragments and tracking
+    parameters are dropped and the remaining query parameters are sorted.
+    """
+    url = url.strip()
+    if not re.match(r'^https?://', url, re.IGNORECASE):
+        url = 'https://' + url
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(k))
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def freshness_lifetime(headers: Mapping[str, str], default_ttl: float) -> Optional[float]:
+    """
+    Work out how long a response may be served without revalidation
+
+    :return: Lifetime in seconds, or None if the response must not be stored
+    """
+    cache_control = (headers.get("Cache-Control") or "").lower()
+    directives = {}
+    for part in cache_control.split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name] = value.strip('"')
+
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                return 0
+
+    expires = _parse_http_date(headers.get("Expires"))
+    if headers.get("Expires") is not None:
+        if expires is None:
+            return 0
+        date = _parse_http_date(headers.get("Date")) or time.time()
+        return max(0, expires - date)
+
+    last_modified = _parse_http_date(headers.get("Last-Modified"))
+    if last_modified is not None:
+        # Heuristic freshness: 10% of the time since the last modification
+        date = _parse_http_date(headers.get("Date")) or time.time()
+        return min(max(0, (date - last_modified) * 0.1), 86400)
+
+    return default_ttl
+
+class PageEntry:
+    """Extracted text of a page plus the validators needed to revalidate it"""
+
+    def __init__(self, content: str, headers: Mapping[str, str], lifetime: float):
+        self.content = content
+        self.etag = headers.get("ETag")
+        self.last_modified = headers.get("Last-Modified")
+        self.expires_at = time.time() + lifetime
+        self.size = len(content.encode("utf-8"))
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers for revalidating this entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class PageCache:
+    """
+    LRU cache of extracted page text bounded by total size in bytes.
+    Freshness follows Cache-Control/Expires; stale entries that carry an
+    ETag or Last-Modified are kept so they can be revalidated with a
+    conditional request.
+    """
+
+    def __init__(self, max_bytes: int, default_ttl: float = 300):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, PageEntry]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[PageEntry]:
+        """Return the entry for key, fresh or stale, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, content: str, headers: Mapping[str, str]) -> None:
+        """Store extracted content unless the response forbids it"""
+        lifetime = freshness_lifetime(headers, self.default_ttl)
+        if lifetime is None:
+            return
+        entry = PageEntry(content, headers, lifetime)
+        if entry.size > self.max_bytes:
+            return
+        if lifetime == 0 and not (entry.etag or entry.last_modified):
+            # Could never be served or revalidated
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def refresh(self, key: str, headers: Mapping[str, str]) -> None:
+        """Extend an entry's lifetime after a 304 Not Modified response"""
+        lifetime = freshness_lifetime(headers, self.default_ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if lifetime is None:
+                self._bytes -= entry.size
+                del self._entries[key]
+                return
+            entry.expires_at = time.time() + lifetime
+            entry.etag = headers.get("ETag") or entry.etag
+            entry.last_modified = headers.get("Last-Modified") or entry.last_modified
+
+    def record(self, outcome: str) -> None:
+        """Count a lookup outcome: 'hit', 'revalidated' or 'miss'"""
+        with self._lock:
+            if outcome == "hit":
+                self.hits += 1
+            elif outcome == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.revalidated + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.revalidated) / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,103 @@
+import threading, time
+from collections import OrderedDict
+from typing import Any, Dict
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Take tokens if available; callers must hold their own lock"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+class RateLimiter:
+    """
+    Per-sender and global token buckets for starting new turns. Only the
+    most recently seen `max_senders` senders keep a bucket.
+    """
+
+    def __init__(self, sender_rate: float, sender_burst: float, global_rate: float, global_burst: float,
+                 busy_cooldown: float = 30, max_senders: int = 10000):
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.busy_cooldown = busy_cooldown
+        self.max_senders = max_senders
+        self._global = TokenBucket(global_rate, global_burst)
+        self._senders: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._busy_notified: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, sender_id: str) -> bool:
+        """Return True if the sender may start a new turn now"""
+        with self._lock:
+            bucket = self._senders.get(sender_id)
+            if bucket is None:
+                bucket = self._senders[sender_id] = TokenBucket(self.sender_rate, self.sender_burst)
+                while len(self._senders) > self.max_senders:
+                    self._senders.popitem(last=False)
+            else:
+                self._senders.move_to_end(sender_id)
+
+            # Check the sender first so one chatty sender does not drain the global bucket
+            if not bucket.try_acquire():
+                return False
+            if not self._global.try_acquire():
+                bucket.tokens += 1
+                return False
+            return True
+
+    def allow_global(self) -> bool:
+        """Return True if background work may make an LLM call now, charged to the global bucket only"""
+        with self._lock:
+            return self._global.try_acquire()
+
+    def should_notify_busy(self, sender_id: str) -> bool:
+        """Return True if the sender has not been sent a busy reply recently"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._busy_notified.get(sender_id)
+            if last is not None and now - last < self.busy_cooldown:
+                return False
+            self._busy_notified[sender_id] = now
+            self._busy_notified.move_to_end(sender_id)
+            while len(self._busy_notified) > self.max_senders:
+                self._busy_notified.popitem(last=False)
+            return True
+
+class MessageDeduper:
+    """Remembers recently seen Messenger message ids (mid) to drop retried webhooks"""
+
+    def __init__(self, ttl: float = 600, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, mid: str) -> bool:
+        """Return True if mid was already seen, otherwise remember it"""
+        now = time.monotonic()
+        with self._lock:
+            while self._seen:
+                oldest_mid, seen_at = next(iter(self._seen.items()))
+                if now - seen_at <= self.ttl and len(self._seen) < self.max_size:
+                    break
+                del self._seen[oldest_mid]
+            if mid in self._seen:
+                return True
+            self._seen[mid] = now
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"tracked": len(self._seen)}
@@ -0,0 +1,145 @@
+import threading, time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import metrics
+from metrics import Histogram
+
+# Turn types the router distinguishes
+SELECT = "select"          # deciding whether and which tool to call, or small talk
+SYNTHESIZE = "synthesize"  # writing the answer from tool results
+SUMMARY = "summary"        # background conversation summaries
+
+class ModelStats:
+    """Latency and outcome history of one model"""
+
+    def __init__(self, window: int = 50):
+        self.latency = Histogram(window)
+        self.outcomes = deque(maxlen=window)
+        self.successes = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.cooldown_until = 0.0
+
+    def success_rate(self) -> float:
+        if not self.outcomes:
+            return 1.0
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "successes": self.successes,
+            "rate_limited": self.rate_limited,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "success_rate": round(self.success_rate(), 4),
+            "cooling_down": self.cooldown_until > time.monotonic(),
+            "latency": self.latency.summary(),
+        }
+
+class ModelRouter:
+    """
+    Picks the order in which models are tried for an LLM call.
+
+    Tool selection and summaries prefer the small model, synthesis the large
+    one, and the fallbacks follow. Models that were rate limited are skipped
+    while they cool down, models that mostly fail recently and models whose
+    p95 latency does not fit the remaining turn budget move to the back.
+    """
+
+    def __init__(self, large_model: str, small_model: str = "", fallback_models: List[str] = None,
+                 routing: bool = True, cooldown: float = 30, min_samples: int = 5):
+        self.large_model = large_model
+        self.small_model = small_model
+        self.fallback_models = list(fallback_models or [])
+        self.routing = routing and bool(small_model)
+        self.cooldown = cooldown
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._stats: Dict[str, ModelStats] = {}
+
+    def _get_stats(self, model: str) -> ModelStats:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats()
+        return stats
+
+    def preference(self, kind: str) -> List[str]:
+        """Models for a turn type in order of preference, before health checks"""
+        if not self.routing:
+            models = [self.large_model] + self.fallback_models
+        elif kind in (SELECT, SUMMARY):
+            models = [self.small_model, self.large_model] + self.fallback_models
+        else:
+            models = [self.large_model] + self.fallback_models + [self.small_model]
+        ordered = []
+        for model in models:
+            if model and model not in ordered:
+                ordered.append(model)
+        return ordered
+
+    def candidates(self, kind: str, remaining: Optional[float] = None) -> List[str]:
+        """
+        Models to try in order for a call
+
+        :param kind: SELECT, SYNTHESIZE or SUMMARY
+        :param remaining: Seconds left in the turn's latency budget, if any
+        """
+        now = time.monotonic()
+        ranked = []
+        with self._lock:
+            for position, model in enumerate(self.preference(kind)):
+                stats = self._get_stats(model)
+                cooling_down = stats.cooldown_until > now
+                unhealthy = len(stats.outcomes) >= self.min_samples and stats.success_rate() < 0.5
+                too_slow = (remaining is not None and stats.latency.count >= self.min_samples
+                            and stats.latency.percentile(95) > remaining)
+                ranked.append(((cooling_down, unhealthy, too_slow, position), model))
+        ranked.sort()
+        return [model for _, model in ranked]
+
+    def available(self, kind: str) -> bool:
+        """Return True if a model for the turn type is not cooling down after a rate limit"""
+        now = time.monotonic()
+        with self._lock:
+            return any(self._get_stats(model).cooldown_until <= now for model in self.preference(kind))
+
+    def record_success(self, model: str, seconds: Optional[float] = None) -> None:
+        """
+        Record a successful call
+
+        :param seconds: Duration of the full response; None if it was cut short,
+            which only counts towards the model's health
+        """
+        with self._lock:
+            stats = self._get_stats(model)
+            if seconds is not None:
+                stats.latency.observe(seconds)
+            stats.outcomes.append(1)
+            stats.successes += 1
+        if seconds is not None:
+            metrics.observe(f"llm.{model}.seconds", seconds)
+
+    def record_failure(self, model: str, reason: str, retry_after: float = None) -> None:
+        """
+        Record a failed call
+
+        :param reason: 'rate_limited', 'timeout' or 'error'
+        :param retry_after: Seconds the API asked us to wait, for rate limits
+        """
+        with self._lock:
+            stats = self._get_stats(model)
+            stats.outcomes.append(0)
+            if reason == "rate_limited":
+                stats.rate_limited += 1
+                stats.cooldown_until = time.monotonic() + (retry_after or self.cooldown)
+            elif reason == "timeout":
+                stats.timeouts += 1
+            else:
+                stats.errors += 1
+        metrics.inc(f"llm.{reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {model: stats.summary() for model, stats in self._stats.items()}
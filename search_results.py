@@ -0,0 +1,169 @@
+import math, re
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import metrics
+from page_cache import canonicalize_url
+from utils import STOPWORDS
+
+REDIRECT_HOSTS = {"duckduckgo.com", "html.duckduckgo.com", "lite.duckduckgo.com"}
+SHINGLE_SIZE = 3
+TITLE_WEIGHT = 2.0
+# Rank bonus of the first result; the search engine's order is a useful signal
+POSITION_WEIGHT = 0.5
+
+def decode_result_url(url: str) -> str:
+    """
+    Return the target of a DuckDuckGo redirect link
+    (//duckduckgo.com/l/?uddg=https%3A%2F%2Fexample.com%2F&rut=...), or the
+    URL itself. Protocol-relative URLs get https and fragments are dropped.
+    """
+    url = url.strip()
+    if url.startswith("//"):
+        url = "https:" + url
+    parts = urlsplit(url)
+    if parts.hostname in REDIRECT_HOSTS and parts.path.startswith("/l/"):
+        target = parse_qs(parts.query).get("uddg")
+        if target:
+            return decode_result_url(target[0])
+    if parts.fragment:
+        url = urlunsplit(parts._replace(fragment=""))
+    return url
+
+def is_ad(url: str) -> bool:
+    """Ad results stay on a DuckDuckGo click-tracking URL after decoding"""
+    return urlsplit(url if "//" in url else "https://" + url).hostname in REDIRECT_HOSTS
+
+def url_key(url: str) -> str:
+    """
+    Host, path and query of a URL, ignoring scheme, 'www.', trailing slash and
+    tracking parameters; the query tells apart pages like watch?v=...
+    """
+    parts = urlsplit(canonicalize_url(url))
+    host = parts.netloc
+    if host.startswith("www."):
+        host = host[4:]
+    key = host + parts.path.rstrip("/")
+    return f"{key}?{parts.query}" if parts.query else key
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r'\w+', text.lower())
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[Tuple[str, ...]]:
+    """Word n-grams of a text, or its single words when it is shorter"""
+    words = tokenize(text)
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+def score_results(results: List[Dict[str, str]], query: str) -> List[float]:
+    """
+    Lexical relevance of each result to the query: query terms found in the
+    title and snippet, weighted by how rare they are among the results, plus
+    a small bonus for the search engine's own order
+    """
+    terms = [t for t in tokenize(query) if t not in STOPWORDS] or tokenize(query)
+    documents = [(Counter(tokenize(r["title"])), Counter(tokenize(r["snippet"]))) for r in results]
+    count = len(results)
+    scores = []
+    for position, (title, snippet) in enumerate(documents):
+        score = 0.0
+        for term in set(terms):
+            frequency = TITLE_WEIGHT * title[term] + snippet[term]
+            if not frequency:
+                continue
+            containing = sum(1 for t, s in documents if term in t or term in s)
+            idf = math.log(1 + (count - containing + 0.5) / (containing + 0.5))
+            # Saturate repeated terms, like BM25
+            score += idf * frequency / (frequency + 1.0)
+        scores.append(score + POSITION_WEIGHT / (position + 1))
+    return scores
+
+def postprocess_results(results: List[Dict[str, str]], query: str, limit: int = 5,
+                        similarity: float = 0.6) -> List[Dict[str, str]]:
+    """
+    Clean up raw search results before they are shown to the model
+
+    :param results: Results from extract_search_results or parse_search_results
+    :param query: The search query, for ranking
+    :param limit: Number of results to keep
+    :param similarity: Snippet shingle overlap at which a result counts as a duplicate
+    :return: Results with decoded URLs, without duplicates, best first
+    """
+    unique = []
+    seen_urls = set()
+    dropped_urls = 0
+    for result in results:
+        url = decode_result_url(result["url"]) if result.get("url") else ""
+        if url and is_ad(url):
+            dropped_urls += 1
+            continue
+        key = url_key(url) if url else None
+        if key in seen_urls:
+            dropped_urls += 1
+            continue
+        if key:
+            seen_urls.add(key)
+        unique.append(dict(result, url=url))
+
+    scores = score_results(unique, query)
+    ranked = [result for _, _, result in
+              sorted(zip(scores, range(len(unique)), unique), key=lambda item: (-item[0], item[1]))]
+
+    kept = []
+    kept_shingles = []
+    dropped_snippets = 0
+    for result in ranked:
+        text_shingles = shingles(result["snippet"] or result["title"])
+        if any(jaccard(text_shingles, other) >= similarity for other in kept_shingles):
+            dropped_snippets += 1
+            continue
+        kept.append(result)
+        kept_shingles.append(text_shingles)
+        if len(kept) >= limit:
+            break
+
+    metrics.inc("search.duplicate_urls", dropped_urls)
+    metrics.inc("search.duplicate_snippets", dropped_snippets)
+    return kept
+
+def format_result(result: Dict[str, str], snippet: Optional[str] = None) -> str:
+    return (
+        f"Title: {result['title']}\n"
+        f"URL: {result['url']}\n"
+        f"Summary: {result['snippet'] if snippet is None else snippet}\n"
+    )
+
+def _shortened(result: Dict[str, str], max_chars: int) -> str:
+    """A result cut down to max_chars: its summary first, then its title"""
+    excess = len(format_result(result, "...")) - max_chars
+    if excess <= 0:
+        return format_result(result, result["snippet"][:-excess] + "...")
+    title = result["title"][:max(0, len(result["title"]) - excess - 3)] + "..."
+    return format_result(dict(result, title=title), "...")
+
+def format_results(results: List[Dict[str, str]], max_chars: int = 2000) -> str:
+    """
+    Format results for the prompt, stopping before `max_chars` characters.
+    The first result is always included, with its summary shortened if needed.
+    """
+    formatted = []
+    used = 0
+    for result in results:
+        text = format_result(result)
+        separator = 2 if formatted else 0
+        if used + separator + len(text) > max_chars:
+            if not formatted:
+                formatted.append(_shortened(result, max_chars))
+            break
+        formatted.append(text)
+        used += separator + len(text)
+    text = "\n\n".join(formatted)
+    metrics.observe("search.formatted_chars", len(text))
+    return text
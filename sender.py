@@ -0,0 +1,139 @@
+import asyncio, random, re, time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from aio import get_http_client
+from deadline import remaining, timeout_for
+import metrics
+from config import (PAGE_ACCESS_TOKEN, GRAPH_API_URL, SEND_TIMEOUT, SEND_MAX_RETRIES,
+                    SEND_RETRY_BACKOFF, TYPING_INDICATOR, TYPING_REFRESH_INTERVAL)
+
+# Messenger rejects text messages longer than this
+MESSAGE_LIMIT = 2000
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    Split a long reply into chunks of at most `limit` characters, preferring
+    paragraph, line, sentence and word boundaries in that order
+    """
+    text = text.strip()
+    chunks = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = -1
+        for boundary in ("\n\n", "\n"):
+            index = window.rfind(boundary)
+            if index > limit // 2:
+                cut = index
+                break
+        if cut == -1:
+            sentence_ends = [m.end() for m in re.finditer(r'[.!?](\s)', window)]
+            if sentence_ends and sentence_ends[-1] > limit // 2:
+                cut = sentence_ends[-1]
+        if cut == -1:
+            index = window.rfind(" ")
+            cut = index if index > limit // 2 else limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), 30.0)
+    return SEND_RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, SEND_RETRY_BACKOFF)
+
+async def post_to_graph(payload: Dict[str, Any], kind: str = "message", deadline: Optional[float] = None) -> bool:
+    """
+    POST a payload to the Send API over the pooled client, retrying 429s,
+    5xx responses and network errors with exponential backoff
+
+    :param deadline: time.monotonic() value after which no attempt is started
+    :return: True if the Send API accepted the payload
+    """
+    params = {'access_token': PAGE_ACCESS_TOKEN}
+    recipient_id = payload.get('recipient', {}).get('id')
+    for attempt in range(SEND_MAX_RETRIES + 1):
+        timeout = timeout_for(SEND_TIMEOUT, deadline)
+        if timeout <= 0:
+            print(f"Giving up sending {kind} to {recipient_id}: out of time")
+            metrics.inc("send.deadline_exceeded")
+            break
+        started_at = time.monotonic()
+        response = None
+        try:
+            response = await get_http_client().post(GRAPH_API_URL, params=params, json=payload, timeout=timeout)
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+                metrics.observe(f"send.{kind}_seconds", time.monotonic() - started_at)
+                return True
+            error = f"HTTP {response.status_code}"
+        except httpx.HTTPStatusError as e:
+            # Other 4xx errors will not succeed on retry
+            print(f"Error sending {kind} to {recipient_id}: {str(e)}")
+            metrics.inc("send.failures")
+            return False
+        except httpx.TransportError as e:
+            error = str(e) or type(e).__name__
+
+        if attempt == SEND_MAX_RETRIES:
+            print(f"Error sending {kind} to {recipient_id}: {error}")
+            break
+        delay = _retry_delay(response, attempt)
+        left = remaining(deadline)
+        if left is not None and delay >= left:
+            print(f"Error sending {kind} to {recipient_id}: {error}, no time left to retry")
+            metrics.inc("send.deadline_exceeded")
+            break
+        metrics.inc("send.retries")
+        print(f"Retrying {kind} to {recipient_id} in {delay:.1f}s: {error}")
+        await asyncio.sleep(delay)
+
+    metrics.inc("send.failures")
+    return False
+
+async def send_text(recipient_id: str, text: str, deadline: Optional[float] = None) -> bool:
+    """
+    Send a text reply, split into ordered chunks if it is longer than
+    Messenger allows. Chunks are sent one after another so they arrive in order.
+
+    :param deadline: time.monotonic() value after which no more attempts are made
+    :return: True if every chunk was delivered
+    """
+    chunks = split_message(text)
+    metrics.inc("send.messages")
+    for chunk in chunks:
+        metrics.inc("send.chunks")
+        payload = {
+            'recipient': {'id': recipient_id},
+            'message': {'text': chunk}
+        }
+        if not await post_to_graph(payload, deadline=deadline):
+            return False
+    return True
+
+async def send_action(recipient_id: str, action: str) -> bool:
+    """Send a sender action: 'typing_on', 'typing_off' or 'mark_seen'"""
+    payload = {
+        'recipient': {'id': recipient_id},
+        'sender_action': action
+    }
+    return await post_to_graph(payload, kind="action")
+
+async def _keep_typing(recipient_id: str) -> None:
+    # Messenger turns the indicator off after ~20s or when a message is sent
+    while True:
+        await send_action(recipient_id, "typing_on")
+        await asyncio.sleep(TYPING_REFRESH_INTERVAL)
+
+def start_typing(recipient_id: str) -> Optional[asyncio.Task]:
+    """
+    Show the typing indicator to the recipient until the returned task is
+    cancelled; must be called on the event loop
+    """
+    if not TYPING_INDICATOR:
+        return None
+    return asyncio.ensure_future(_keep_typing(recipient_id))
@@ -0,0 +1,236 @@
+import asyncio, hashlib, os, sqlite3, threading, time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): only a single process is supported
+    fcntl = None
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive lock on `path`.lock, blocking until it is free"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+_held_locks = []
+
+def hold_file_lock_forever(path: str) -> bool:
+    """
+    Take the lock on `path`.lock without waiting and keep it until the
+    process exits, so one process can claim a job for itself
+
+    :return: False if another process holds it
+    """
+    if fcntl is None:
+        return True
+    fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    _held_locks.append(fd)
+    return True
+
+class SenderLocks:
+    """
+    Cross-process per-sender locks, so two worker processes never run turns
+    for the same sender at once. Senders are hashed onto a fixed number of
+    lock files; sharing a file only means two senders occasionally wait for
+    each other.
+    """
+
+    def __init__(self, directory: str, buckets: int = 1024, poll_interval: float = 0.05):
+        self.directory = directory
+        self.buckets = buckets
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sender_id: str) -> str:
+        bucket = int(hashlib.sha1(sender_id.encode("utf-8")).hexdigest()[:8], 16) % self.buckets
+        return os.path.join(self.directory, f"sender-{bucket}.lock")
+
+    async def acquire(self, sender_id: str) -> Optional[int]:
+        """
+        Wait for the sender's lock without blocking the event loop
+
+        :return: A handle for release(), None if locking is unavailable
+        """
+        if fcntl is None:
+            return None
+        fd = os.open(self._path(sender_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    await asyncio.sleep(self.poll_interval)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    @contextmanager
+    def hold(self, sender_id: str, blocking: bool = True):
+        """
+        Hold the sender's lock from a thread, for work outside of turns
+
+        :param blocking: If False, yield False at once when another turn holds the lock
+        """
+        if fcntl is None:
+            yield True
+            return
+        fd = os.open(self._path(sender_id), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+        finally:
+            os.close(fd)
+
+    def release(self, handle: Optional[int]) -> None:
+        if handle is not None:
+            # Closing the descriptor releases the lock
+            os.close(handle)
+
+class SharedStateDB:
+    """
+    Small SQLite database (WAL mode) for state every worker process must
+    agree on: rate limit buckets, busy-reply cooldowns and seen message ids.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+                    conn.execute("CREATE TABLE IF NOT EXISTS busy_notified (sender_id TEXT PRIMARY KEY, notified_at REAL NOT NULL)")
+                    conn.execute("CREATE TABLE IF NOT EXISTS seen_messages (mid TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_messages_seen_at ON seen_messages (seen_at)")
+                    self._initialized = True
+        return conn
+
+class SharedRateLimiter:
+    """
+    RateLimiter with its token buckets in a SharedStateDB, so the limits hold
+    across all worker processes. Same interface as ratelimit.RateLimiter.
+    """
+
+    def __init__(self, db: SharedStateDB, sender_rate: float, sender_burst: float, global_rate: float,
+                 global_burst: float, busy_cooldown: float = 30, idle_expiry: float = 3600):
+        self.db = db
+        self.sender_rate = sender_rate
+        self.sender_burst = sender_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.busy_cooldown = busy_cooldown
+        self.idle_expiry = idle_expiry
+        self._last_cleanup = 0.0
+
+    def _tokens(self, conn: sqlite3.Connection, key: str, rate: float, capacity: float, now: float) -> float:
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return capacity
+        return min(capacity, row[0] + (now - row[1]) * rate)
+
+    def _cleanup(self, conn: sqlite3.Connection, now: float) -> None:
+        # Idle buckets are full again, dropping them changes nothing
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        conn.execute("DELETE FROM buckets WHERE key != 'global' AND updated < ?", (now - self.idle_expiry,))
+        conn.execute("DELETE FROM busy_notified WHERE notified_at < ?", (now - self.busy_cooldown,))
+
+    def allow(self, sender_id: str) -> bool:
+        """Return True if the sender may start a new turn now"""
+        now = time.time()
+        conn = self.db.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._cleanup(conn, now)
+            sender_key = f"sender:{sender_id}"
+            sender_tokens = self._tokens(conn, sender_key, self.sender_rate, self.sender_burst, now)
+            global_tokens = self._tokens(conn, "global", self.global_rate, self.global_burst, now)
+            allowed = sender_tokens >= 1 and global_tokens >= 1
+            if allowed:
+                sender_tokens -= 1
+                global_tokens -= 1
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                             [(sender_key, sender_tokens, now), ("global", global_tokens, now)])
+            return allowed
+
+    def allow_global(self) -> bool:
+        """Return True if background work may make an LLM call now, charged to the global bucket only"""
+        now = time.time()
+        conn = self.db.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            global_tokens = self._tokens(conn, "global", self.global_rate, self.global_burst, now)
+            allowed = global_tokens >= 1
+            if allowed:
+                global_tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         ("global", global_tokens, now))
+            return allowed
+
+    def should_notify_busy(self, sender_id: str) -> bool:
+        """Return True if the sender has not been sent a busy reply recently"""
+        now = time.time()
+        conn = self.db.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT notified_at FROM busy_notified WHERE sender_id = ?", (sender_id,)).fetchone()
+            if row is not None and now - row[0] < self.busy_cooldown:
+                return False
+            conn.execute("INSERT OR REPLACE INTO busy_notified (sender_id, notified_at) VALUES (?, ?)", (sender_id, now))
+            return True
+
+class SharedMessageDeduper:
+    """MessageDeduper backed by a SharedStateDB, for webhooks retried to another worker"""
+
+    def __init__(self, db: SharedStateDB, ttl: float = 600):
+        self.db = db
+        self.ttl = ttl
+        self._last_cleanup = 0.0
+
+    def seen(self, mid: str) -> bool:
+        """Return True if mid was already seen, otherwise remember it"""
+        now = time.time()
+        conn = self.db.conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if now - self._last_cleanup > 60:
+                self._last_cleanup = now
+                conn.execute("DELETE FROM seen_messages WHERE seen_at < ?", (now - self.ttl,))
+            row = conn.execute("SELECT seen_at FROM seen_messages WHERE mid = ?", (mid,)).fetchone()
+            if row is not None and now - row[0] <= self.ttl:
+                return True
+            conn.execute("INSERT OR REPLACE INTO seen_messages (mid, seen_at) VALUES (?, ?)", (mid, now))
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        row = self.db.conn().execute("SELECT COUNT(*) FROM seen_messages").fetchone()
+        return {"tracked": row[0], "shared": True}
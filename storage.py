@@ -0,0 +1,259 @@
+import os, json, sqlite3, threading, time, zlib
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Optional
+
+from shared import file_lock
+
+class MemoryStore(ABC):
+    """
+    Storage backend for chat memory. Every operation works on a single
+    sender's history so its cost does not grow with the number of users.
+    """
+
+    @abstractmethod
+    def load(self, sender_id: str) -> List[Dict[str, Any]]:
+        """Return the stored entries for a sender, oldest first"""
+
+    @abstractmethod
+    def append(self, sender_id: str, entries: List[Dict[str, Any]], max_entries: int) -> None:
+        """Append entries for a sender and keep only the last max_entries"""
+
+    @abstractmethod
+    def replace(self, sender_id: str, entries: List[Dict[str, Any]]) -> None:
+        """Overwrite the full history of a sender"""
+
+    @abstractmethod
+    def delete(self, sender_id: str) -> None:
+        """Remove all entries for a sender"""
+
+    @abstractmethod
+    def senders(self) -> List[str]:
+        """Return every sender that has stored entries"""
+
+    def compact(self, vacuum: bool = False) -> None:
+        """Give space freed by deletes back to the file system where the backend needs it"""
+        pass
+
+    def close(self) -> None:
+        pass
+
+class SQLiteStore(MemoryStore):
+    """
+    SQLite store in WAL mode. Entries are rows keyed by sender, so appends and
+    reads only touch one sender's rows and concurrent writers do not clobber
+    each other.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS messages ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "sender_id TEXT NOT NULL, "
+                        "entry TEXT NOT NULL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_id, id)")
+                    self._initialized = True
+        return conn
+
+    def load(self, sender_id: str) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT entry FROM messages WHERE sender_id = ? ORDER BY id", (sender_id,)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def append(self, sender_id: str, entries: List[Dict[str, Any]], max_entries: int) -> None:
+        if not entries:
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO messages (sender_id, entry) VALUES (?, ?)",
+                [(sender_id, json.dumps(entry, ensure_ascii=False)) for entry in entries]
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE sender_id = ? AND id <= ("
+                "SELECT id FROM messages WHERE sender_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (sender_id, sender_id, max_entries)
+            )
+
+    def replace(self, sender_id: str, entries: List[Dict[str, Any]]) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM messages WHERE sender_id = ?", (sender_id,))
+            conn.executemany(
+                "INSERT INTO messages (sender_id, entry) VALUES (?, ?)",
+                [(sender_id, json.dumps(entry, ensure_ascii=False)) for entry in entries]
+            )
+
+    def delete(self, sender_id: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM messages WHERE sender_id = ?", (sender_id,))
+
+    def senders(self) -> List[str]:
+        rows = self._conn().execute("SELECT DISTINCT sender_id FROM messages").fetchall()
+        return [row[0] for row in rows]
+
+    def compact(self, vacuum: bool = False) -> None:
+        conn = self._conn()
+        if vacuum:
+            # Rewrites the whole file and blocks writers while it runs
+            conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+class JsonFileStore(MemoryStore):
+    """
+    Legacy store that keeps every sender in one JSON file. Each write
+    rewrites the whole file, so it is only suitable for small deployments.
+    Writes hold a file lock so several processes can share the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, List[Dict[str, Any]]]:
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"Error loading memory file: {str(e)}")
+        return {}
+
+    def _write(self, memory: Dict[str, List[Dict[str, Any]]]) -> None:
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(memory, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def load(self, sender_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return self._read().get(sender_id, [])
+
+    def append(self, sender_id: str, entries: List[Dict[str, Any]], max_entries: int) -> None:
+        with self._lock, file_lock(self.path):
+            memory = self._read()
+            history = memory.get(sender_id, []) + list(entries)
+            memory[sender_id] = history[-max_entries:]
+            self._write(memory)
+
+    def replace(self, sender_id: str, entries: List[Dict[str, Any]]) -> None:
+        with self._lock, file_lock(self.path):
+            memory = self._read()
+            memory[sender_id] = list(entries)
+            self._write(memory)
+
+    def delete(self, sender_id: str) -> None:
+        with self._lock, file_lock(self.path):
+            memory = self._read()
+            if sender_id in memory:
+                del memory[sender_id]
+                self._write(memory)
+
+    def senders(self) -> List[str]:
+        with self._lock:
+            return list(self._read().keys())
+
+class ArchiveStore:
+    """
+    Cold conversations moved out of the memory store: one zlib-compressed
+    JSON blob per sender in a separate SQLite database
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS archive ("
+                        "sender_id TEXT PRIMARY KEY, "
+                        "last_active REAL NOT NULL, "
+                        "archived_at REAL NOT NULL, "
+                        "entries INTEGER NOT NULL, "
+                        "data BLOB NOT NULL)"
+                    )
+                    self._initialized = True
+        return conn
+
+    def put(self, sender_id: str, entries: List[Dict[str, Any]], last_active: float) -> None:
+        """Archive a sender's history; last_active is a Unix timestamp"""
+        data = zlib.compress(json.dumps(entries, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 9)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO archive (sender_id, last_active, archived_at, entries, data) VALUES (?, ?, ?, ?, ?)",
+                (sender_id, last_active, time.time(), len(entries), data)
+            )
+
+    def get(self, sender_id: str) -> Optional[List[Dict[str, Any]]]:
+        row = self._conn().execute("SELECT data FROM archive WHERE sender_id = ?", (sender_id,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def delete(self, sender_id: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM archive WHERE sender_id = ?", (sender_id,))
+
+    def expire(self, before: float) -> int:
+        """Delete archives of senders inactive since before; return how many"""
+        conn = self._conn()
+        with conn:
+            return conn.execute("DELETE FROM archive WHERE last_active < ?", (before,)).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        row = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(entries), 0), COALESCE(SUM(LENGTH(data)), 0) FROM archive").fetchone()
+        return {"senders": row[0], "entries": row[1], "compressed_bytes": row[2]}
+
+    def compact(self, vacuum: bool = False) -> None:
+        conn = self._conn()
+        if vacuum:
+            conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def create_store(backend: str, path: str) -> MemoryStore:
+    """
+    Create a memory store
+
+    :param backend: 'sqlite' or 'json'
+    :param path: Database or JSON file path
+    """
+    if backend == "sqlite":
+        return SQLiteStore(path)
+    if backend == "json":
+        return JsonFileStore(path)
+    raise ValueError(f"Unknown memory backend: {backend}")
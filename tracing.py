@@ -0,0 +1,196 @@
+import asyncio, contextvars, functools, os, sys, threading, time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import metrics
+from config import TRACE_TURNS, PROFILE_SENDER, PROFILE_INTERVAL, PROFILE_DIR
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+_current_profiler: contextvars.ContextVar = contextvars.ContextVar("current_profiler", default=None)
+_profiled_sender: Optional[str] = PROFILE_SENDER or None
+
+class Trace:
+    """Spans and counters recorded during one turn"""
+
+    def __init__(self, sender_id: str):
+        self.sender_id = sender_id
+        self.started_at = time.monotonic()
+        self.iteration = 0
+        self.spans: List[Dict[str, Any]] = []
+        self.counters: Dict[str, float] = {}
+
+    def add(self, name: str, amount: float = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def breakdown(self) -> Dict[str, float]:
+        """Total seconds spent per stage"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["seconds"]
+        return totals
+
+    def format(self) -> str:
+        elapsed = time.monotonic() - self.started_at
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in
+                           sorted(self.breakdown().items(), key=lambda item: -item[1]))
+        counters = ", ".join(f"{name} {value:g}" for name, value in self.counters.items())
+        return (f"Turn for {self.sender_id}: {elapsed:.2f}s over {self.iteration} iterations"
+                f" [{stages}]" + (f" ({counters})" if counters else ""))
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def start_trace(sender_id: str) -> Trace:
+    """Start tracing the current turn; spans opened in this task and the threads it starts are recorded"""
+    trace = Trace(sender_id)
+    _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace: Trace) -> None:
+    """Record the turn's totals and log its latency breakdown"""
+    _current_trace.set(None)
+    metrics.observe("turn.seconds", time.monotonic() - trace.started_at)
+    metrics.observe("turn.iterations", trace.iteration)
+    for name, value in trace.counters.items():
+        metrics.observe(f"turn.{name}", value)
+    if TRACE_TURNS:
+        print(trace.format())
+
+def count(name: str, amount: float = 1) -> None:
+    """Add to a per-turn counter, such as tokens used"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, amount)
+
+@contextmanager
+def span(name: str):
+    """
+    Time a stage of the turn. The duration goes into the `stage.<name>_seconds`
+    histogram and, inside a traced turn, into the turn's spans.
+    """
+    trace = _current_trace.get()
+    started_at = time.monotonic()
+    try:
+        yield
+    finally:
+        seconds = time.monotonic() - started_at
+        metrics.observe(f"stage.{name}_seconds", seconds)
+        if trace is not None:
+            # list.append is atomic, spans may finish in worker threads
+            trace.spans.append({
+                "name": name,
+                "iteration": trace.iteration,
+                "offset": round(started_at - trace.started_at, 4),
+                "seconds": round(seconds, 4),
+            })
+
+def traced(name: str):
+    """Decorator wrapping a function or coroutine function in a span"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class SamplingProfiler:
+    """
+    Samples the stack of one asyncio task, and the tasks it hands its steps
+    to (see track_task), from a background thread.
+
+    Samples are only taken while one of them is actually running on its loop,
+    so other senders' turns sharing the loop are not mixed in. Time the task
+    spends awaiting I/O shows up in the spans instead.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._tasks = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start sampling the calling task; must be called from inside it"""
+        self._tasks.add(asyncio.current_task())
+        loop = asyncio.get_running_loop()
+        thread_id = threading.get_ident()
+
+        def run():
+            while not self._stop.wait(self.interval):
+                if asyncio.current_task(loop) not in self._tasks:
+                    continue
+                frame = sys._current_frames().get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+
+        self._thread = threading.Thread(target=run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def add_task(self, task: asyncio.Task) -> None:
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+def set_profiled_sender(sender_id: Optional[str]) -> None:
+    """Profile the turns of this sender only, or none if sender_id is empty"""
+    global _profiled_sender
+    _profiled_sender = sender_id or None
+
+def get_profiled_sender() -> Optional[str]:
+    return _profiled_sender
+
+def maybe_start_profiler(sender_id: str) -> Optional[SamplingProfiler]:
+    """Start a profiler for the current turn if this sender is being profiled"""
+    if sender_id != _profiled_sender:
+        return None
+    profiler = SamplingProfiler()
+    profiler.start()
+    _current_profiler.set(profiler)
+    return profiler
+
+def track_task(task: asyncio.Task) -> None:
+    """Profile a task the current turn runs part of its work in"""
+    profiler = _current_profiler.get()
+    if profiler is not None:
+        profiler.add_task(task)
+
+def save_profile(sender_id: str, profiler: SamplingProfiler) -> Optional[str]:
+    """
+    Write the samples in collapsed-stack format, which flamegraph.pl and
+    speedscope can read, and log the hottest stacks
+
+    :return: The path of the profile, or None if nothing was sampled
+    """
+    samples = profiler.stop()
+    if not samples:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{sender_id}-{int(time.time())}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, hits in samples.most_common():
+            f.write(f"{stack} {hits}\n")
+    total = sum(samples.values())
+    print(f"Profile for {sender_id}: {total} samples written to {path}")
+    for stack, hits in samples.most_common(5):
+        print(f"  {hits / total:6.1%}  {stack.split(';')[-1]}")
+    return path
@@ -1,44 +1,133 @@
+import re
+
+SAY_TAG = "say_in_middle"
+
+# Tool tags the parser recognizes, mapped to the name of their argument
+TOOL_TAGS = {
+    "web_search": "query",
+    "browse_url": "url",
+}
+
+_tag_pattern = None
+_open_pattern = None
+
+# Punctuation trimmed from the ends of words when normalizing text; symbols
+# inside a word ("c++", "c#", "node.js", "1,000") are kept
+LEADING_PUNCTUATION = "\"'`“”‘’([{<"
+TRAILING_PUNCTUATION = ".,!?;:\"'`“”‘’)]}>"
+
+# Words that carry little meaning in a query or question
+STOPWORDS = {"a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+             "how", "i", "in", "is", "it", "me", "of", "on", "or", "tell", "that", "the", "this", "to",
+             "was", "what", "what's", "whats", "when", "where", "which", "who", "why", "with", "you"}
+
+def normalize_text(text):
+    """
+    Normalize a query or question for cache keys: lower case, collapsed
+    whitespace, quotes and trailing punctuation removed from every word
+    """
+    words = []
+    for word in text.lower().split():
+        word = word.lstrip(LEADING_PUNCTUATION).rstrip(TRAILING_PUNCTUATION)
+        if word:
+            words.append(word)
+    return " ".join(words)
+
+def _compile():
+    global _tag_pattern, _open_pattern
+    names = "|".join(re.escape(tag) for tag in [SAY_TAG] + list(TOOL_TAGS))
+    # The body may not contain another opening tag of the same kind, so an
+    # unclosed tag does not swallow the next one
+    _tag_pattern = re.compile(rf"<({names})>((?:(?!<\1>).)*?)</\1>", re.DOTALL)
+    _open_pattern = re.compile(rf"<({names})>")
+
+_compile()
+
+def register_tool_tag(tag, argument):
+    """
+    Make the parser recognize a new tool tag
+
+    :param tag: Tag name, e.g. 'get_weather' for <get_weather>...</get_weather>
+    :param argument: Key the tag's content is stored under in the tool call
+    """
+    TOOL_TAGS[tag] = argument
+    _compile()
+
+def _event(tag, value):
+    if tag == SAY_TAG:
+        return ("say", value)
+    return ("tool", {"tool": tag, TOOL_TAGS[tag]: value})
+
+def scan_tags(text, pos=0, final=True):
+    """
+    Scan text for tags in a single pass, starting at pos
+
+    Yields (start, end, event) for every complete tag in order, where event
+    is ("say", message) or ("tool", tool_call). Unless final is set, scanning
+    stops at an opening tag whose closing tag has not arrived yet; the
+    position to resume from is returned as the generator's value.
+    """
+    while True:
+        opening = _open_pattern.search(text, pos)
+        if opening is None:
+            if final:
+                return len(text)
+            # An opening tag may be split across chunks
+            partial = text.rfind("<", pos)
+            if partial != -1:
+                prefix = text[partial:]
+                if any(f"<{tag}>".startswith(prefix) for tag in [SAY_TAG] + list(TOOL_TAGS)):
+                    return partial
+            return len(text)
+
+        match = _tag_pattern.match(text, opening.start())
+        if match is not None:
+            yield match.start(), match.end(), _event(match.group(1), match.group(2).strip())
+            pos = match.end()
+            continue
+
+        if not final and text.find(f"</{opening.group(1)}>", opening.end()) == -1:
+            # Wait for the closing tag
+            return opening.start()
+        # Malformed (reopened before it was closed), treat it as plain text
+        pos = opening.end()
+
 def parse_response(response_text):
     """Parse AI response for tool calls, say messages, and task completion"""
     result = {
         "tools": [],
         "say_message": None,
+        "say_messages": [],
+        "items": [],
         "task_finished": None,
         "continue_task": True
     }
-    
-    # Extract say_in_middle message first
-    if "<say_in_middle>" in response_text and "</say_in_middle>" in response_text:
-        start = response_text.find("<say_in_middle>") + len("<say_in_middle>")
-        end = response_text.find("</say_in_middle>")
-        if start < end:
-            result["say_message"] = response_text[start:end].strip()
-            # Remove the processed tag for cleaner tool parsing
-            response_text = response_text[:start-len("<say_in_middle>")] + response_text[end+len("</say_in_middle>"):]
-    
-    # Parse web search tool calls
-    while "<web_search>" in response_text and "</web_search>" in response_text:
-        start = response_text.find("<web_search>") + len("<web_search>")
-        end = response_text.find("</web_search>")
-        if start < end:
-            query = response_text[start:end].strip()
-            result["tools"].append({"tool": "web_search", "query": query})
-            # Remove the processed tag
-            response_text = response_text[:start-len("<web_search>")] + response_text[end+len("</web_search>"):]
-
-    # Parse browse url tool calls
-    while "<browse_url>" in response_text and "</browse_url>" in response_text:
-        start = response_text.find("<browse_url>") + len("<browse_url>")
-        end = response_text.find("</browse_url>")
-        if start < end:
-            url = response_text[start:end].strip()
-            result["tools"].append({"tool": "browse_url", "url": url})
-            # Remove the processed tag
-            response_text = response_text[:start-len("<browse_url>")] + response_text[end+len("</browse_url>"):]
-    
+
+    # One pass over the text: tags are collected in order and everything
+    # between them is kept as leftover text
+    leftover = []
+    last = 0
+    for start, end, (kind, value) in scan_tags(response_text):
+        if start > last:
+            leftover.append(response_text[last:start])
+            result["items"].append(("text", response_text[last:start]))
+        last = end
+        result["items"].append((kind, value))
+        if kind == "say":
+            result["say_messages"].append(value)
+        else:
+            result["tools"].append(value)
+    if last < len(response_text):
+        leftover.append(response_text[last:])
+        result["items"].append(("text", response_text[last:]))
+
+    # Only the first progress message is sent
+    if result["say_messages"]:
+        result["say_message"] = result["say_messages"][0] or None
+
     # Clean remaining text
-    remaining_text = response_text.strip()
-    
+    remaining_text = "".join(leftover).strip()
+
     # If there are no tools and no progress message, this is a final response
     if not result["tools"] and not result["say_message"] and remaining_text:
         result["task_finished"] = remaining_text
@@ -52,4 +141,45 @@ def parse_response(response_text):
 
 def parse_tool_calls(response_text):
     """Parse tool calls from AI response"""
-    return parse_response(response_text)["tools"]
\ No newline at end of file
+    return parse_response(response_text)["tools"]
+
+class StreamParser:
+    """
+    Incremental version of parse_response for streamed LLM output.
+
+    Feed chunks as they arrive; every tag is reported as soon as its closing
+    tag has been received. Everything before `pos` has been fully parsed and
+    the full text seen so far is available as `text`.
+    """
+
+    def __init__(self):
+        self.pos = 0
+        self._parsed = []
+        # Only the unparsed tail is rescanned, so feeding stays linear
+        self._tail = ""
+
+    @property
+    def text(self):
+        return "".join(self._parsed) + self._tail
+
+    def feed(self, chunk):
+        """
+        Add a chunk of output and return the tags it completed, in order.
+        Events are ("say", message) or ("tool", tool_call) tuples.
+        """
+        self._tail += chunk
+        events = []
+        consumed = 0
+        scanner = scan_tags(self._tail, 0, final=False)
+        while True:
+            try:
+                _, consumed, event = next(scanner)
+            except StopIteration as stop:
+                consumed = stop.value
+                break
+            events.append(event)
+        if consumed:
+            self._parsed.append(self._tail[:consumed])
+            self._tail = self._tail[consumed:]
+            self.pos += consumed
+        return events
@@ -1,9 +1,30 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import httpx
 from urllib.parse import quote
-from typing import Dict, List, Union, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional
 
-def extract_search_results(soup: BeautifulSoup) -> List[Dict[str, str]]:
+from aio import get_http_client, run_sync
+from cache import TTLCache
+from utils import normalize_text
+from deadline import timeout_for
+import metrics
+from extract import parse_search_results
+from search_results import postprocess_results, format_results
+from browser import prefetch_pages
+from config import (SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_FILE, HTML_EXTRACTOR, SEARCH_URL,
+                    PREFETCH, PREFETCH_TOP_N, SEARCH_RESULT_LIMIT, SEARCH_RESULTS_MAX_CHARS,
+                    SEARCH_SNIPPET_SIMILARITY)
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_FILE or None, name="search_cache")
+metrics.register_gauge("search_cache", search_cache.stats)
+
+# Start of every message web_search_tool_async returns instead of results
+SEARCH_FAILURE_PREFIXES = ("Web search ", "No search results")
+
+def extract_search_results(soup: "BeautifulSoup") -> List[Dict[str, str]]:
     """Extract search results from BeautifulSoup object"""
     results = []
     for result in soup.select(".result"):
@@ -36,39 +57,72 @@ def extract_search_results(soup: BeautifulSoup) -> List[Dict[str, str]]:
     
     return results
 
-def web_search_tool(query: str) -> str:
+def parse_search_page(html: str) -> List[Dict[str, str]]:
+    """Parse a DuckDuckGo HTML results page with the configured engine"""
+    if HTML_EXTRACTOR == "bs4":
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "html.parser")
+        return extract_search_results(soup)
+    return parse_search_results(html)
+
+async def search_async(query: str, deadline: Optional[float] = None) -> List[Dict[str, str]]:
+    """
+    Search DuckDuckGo and return the structured results, using the cache
+    when the same normalized query was seen recently
+
+    :param query: Search query string
+    :param deadline: time.monotonic() value by which the request must finish
+    :return: List of result dictionaries with title, snippet and url
+    """
+    key = normalize_text(query)
+    # The disk tier is a SQLite file other workers write to, keep it off the event loop
+    cached = await asyncio.to_thread(search_cache.get, key)
+    if cached is not None:
+        return cached
+
+    search_url = f"{SEARCH_URL}?q={quote(query)}"
+    res = await get_http_client().get(search_url, timeout=timeout_for(10, deadline))
+    res.raise_for_status()
+
+    # Parsing is CPU bound, keep it off the event loop
+    results = await asyncio.to_thread(parse_search_page, res.text)
+    if results:
+        await asyncio.to_thread(search_cache.set, key, results)
+    return results
+
+async def web_search_tool_async(query: str, deadline: Optional[float] = None) -> str:
     """
     Performs web search and returns formatted results
-    
+
     :param query: Search query string
+    :param deadline: time.monotonic() value by which the search must finish
     :return: Formatted string of search results or error message
     """
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        
-        search_url = f"https://html.duckduckgo.com/html/?q={quote(query)}"
-        res = requests.get(search_url, headers=headers, timeout=10)
-        res.raise_for_status()
-        
-        soup = BeautifulSoup(res.text, "html.parser")
-        results = extract_search_results(soup)
+        if timeout_for(10, deadline) <= 0:
+            metrics.inc("search.deadline_exceeded")
+            return "Web search skipped: out of time for this message."
+        results = await search_async(query, deadline)
+
+        if not results:
+            return "No search results found."
 
+        # Decode redirect links, drop duplicate pages and snippets, best first
+        results = postprocess_results(results, query, SEARCH_RESULT_LIMIT, SEARCH_SNIPPET_SIMILARITY)
         if not results:
             return "No search results found."
 
-        formatted_results = []
-        for result in results[:5]:  # Get top 5 results
-            formatted_results.append(
-                f"Title: {result['title']}\n"
-                f"URL: {result['url']}\n"
-                f"Summary: {result['snippet']}\n"
-            )
+        if PREFETCH:
+            # The model usually browses one of the top results next
+            prefetch_pages([result['url'] for result in results[:PREFETCH_TOP_N] if result.get('url')])
 
-        return "\n\n".join(formatted_results)
-        
-    except requests.RequestException as e:
+        return format_results(results, SEARCH_RESULTS_MAX_CHARS)
+
+    except httpx.HTTPError as e:
         return f"Web search network error: {str(e)}"
     except Exception as e:
-        return f"Web search error: {str(e)}"
\ No newline at end of file
+        return f"Web search error: {str(e)}"
+
+def web_search_tool(query: str) -> str:
+    """Synchronous wrapper around web_search_tool_async"""
+    return run_sync(web_search_tool_async(query))